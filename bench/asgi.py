@@ -0,0 +1,58 @@
+import asyncio
+import time
+from pathlib import Path
+
+from server import config, core
+
+
+def configure(database: Path, static: Path = Path("dist")) -> config.Config:
+    core.config = config.Config(
+        admin=config.Admin(username="bench", password_hash="bench"),
+        jwt=config.JWT(secret="bench"),
+        locations=config.Locations(database=database, static=static),
+    )
+    return core.config
+
+
+def scope(path: str, method: str = "GET", headers=()) -> dict:
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(k.lower().encode(), v.encode()) for k, v in headers],
+        "client": ("127.0.0.1", 50000),
+        "server": ("testserver", 80),
+    }
+
+
+async def request(app, path: str, method: str = "GET", headers=(), body=b""):
+    messages = []
+    pending = [{"type": "http.request", "body": body, "more_body": False}]
+    done = asyncio.Event()
+
+    async def receive():
+        if pending:
+            return pending.pop()
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        messages.append(message)
+        if message["type"] == "http.response.body" and not message.get("more_body"):
+            done.set()
+
+    await app(scope(path, method, headers), receive, send)
+    return messages
+
+
+async def timeit(fn, n: int) -> float:
+    start = time.perf_counter_ns()
+    for _ in range(n):
+        await fn()
+    return (time.perf_counter_ns() - start) / n
@@ -0,0 +1,90 @@
+import asyncio
+import gc
+import resource
+import sys
+import tracemalloc
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from fastapi import FastAPI
+
+from server import livecontrol
+
+from .asgi import configure
+
+COUNTS = [1000, 10000]
+BUDGET = 512 * 1024 * 1024
+
+
+def scope() -> dict:
+    return {
+        "type": "websocket",
+        "asgi": {"version": "3.0"},
+        "scheme": "ws",
+        "path": "/api/live",
+        "raw_path": b"/api/live",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [],
+        "client": ("127.0.0.1", 50000),
+        "server": ("testserver", 80),
+        "subprotocols": [],
+    }
+
+
+async def idle(app, closed: asyncio.Event, connected: asyncio.Event):
+    messages = [{"type": "websocket.connect"}]
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await closed.wait()
+        return {"type": "websocket.disconnect", "code": 1000}
+
+    async def send(message):
+        if message.get("text") == "CONNECT":
+            connected.set()
+
+    await app(scope(), receive, send)
+
+
+async def hold(app, n: int) -> tuple[float, float]:
+    closed = asyncio.Event()
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    connections = []
+    for _ in range(n):
+        connected = asyncio.Event()
+        connections.append(asyncio.create_task(idle(app, closed, connected)))
+        await connected.wait()
+    elapsed = loop.time() - start
+    gc.collect()
+    per_connection = (tracemalloc.get_traced_memory()[0] - before) / n
+    tracemalloc.stop()
+    assert len(livecontrol.manager.connections) == n
+    closed.set()
+    await asyncio.gather(*connections)
+    return elapsed, per_connection
+
+
+async def main():
+    app = FastAPI()
+    app.include_router(livecontrol.api)
+    soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    with TemporaryDirectory() as tmpdir:
+        configure(Path(tmpdir) / "bench.sqlite3")
+        for n in COUNTS:
+            elapsed, per_connection = await hold(app, n)
+            print(
+                f"{n:6} idle connections: {elapsed * 1e6 / n:7.1f} us/connect, "
+                f"{per_connection / 1024:5.1f} KiB/connection, "
+                f"~{int(BUDGET // per_connection):,} per {BUDGET >> 20} MiB"
+            )
+    print(f"RLIMIT_NOFILE soft limit: {soft} sockets", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,70 @@
+import asyncio
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from server import requestdb
+
+from .asgi import configure, request, timeit
+
+N = 2000
+
+
+class BaseHTTPLogRequests(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next):
+        received = time.time_ns()
+        response = await call_next(request)
+        elapsed = time.time_ns() - received
+        await requestdb.writer.put(
+            requestdb._row(request, received, elapsed, response.status_code, None, 0)
+        )
+        return response
+
+
+def app(middleware=None) -> FastAPI:
+    app = FastAPI()
+    if middleware is not None:
+        app.add_middleware(middleware)
+
+    @app.get("/text")
+    async def text():
+        return PlainTextResponse("x" * 1024)
+
+    @app.get("/stream")
+    async def stream():
+        return StreamingResponse(iter([b"x" * 1024] * 8))
+
+    return app
+
+
+async def main():
+    apps = {
+        "none": app(),
+        "BaseHTTPMiddleware": app(BaseHTTPLogRequests),
+        "ASGI": app(requestdb.LogRequests),
+    }
+    with TemporaryDirectory() as tmpdir:
+        configure(Path(tmpdir) / "bench.sqlite3")
+        await requestdb.opendb()
+        try:
+            for path in ["/text", "/stream"]:
+                baseline = None
+                for name, instance in apps.items():
+                    ns = await timeit(
+                        lambda instance=instance, path=path: request(instance, path), N
+                    )
+                    baseline = ns if baseline is None else baseline
+                    print(
+                        f"{path:8} {name:20} {ns / 1000:8.1f} us/req"
+                        f" (+{(ns - baseline) / 1000:.1f} us)"
+                    )
+        finally:
+            await requestdb.closedb()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
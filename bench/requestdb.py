@@ -0,0 +1,127 @@
+import asyncio
+import random
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import aiosqlite
+from fastapi import Request
+
+from server import requestdb
+
+from .asgi import configure, scope
+
+N = 20_000
+LEGACY_INSERT = (
+    "INSERT INTO requests(received_ts_ns, elapsed_ns, method, url, headers,"
+    " query_params, path_params, client, cookies, status, ttfb_ns, bytes_sent)"
+    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);"
+)
+AGENTS = [
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko)"
+    f" Chrome/{v}.0.0.0 Safari/537.36"
+    for v in range(118, 124)
+] + ["curl/8.4.0", "Googlebot/2.1 (+http://www.google.com/bot.html)"]
+PATHS = ["/", "/login", "/protected/", "/api/state"] + [
+    f"/assets/index-{i:08x}.js" for i in range(40)
+]
+
+
+def requests(rng: random.Random) -> list[Request]:
+    result = []
+    for _ in range(N):
+        s = scope(
+            rng.choice(PATHS),
+            headers=[
+                ("Host", "aidan.software"),
+                ("User-Agent", rng.choice(AGENTS)),
+                ("Accept", "text/html,application/xhtml+xml,*/*;q=0.8"),
+                ("Accept-Language", "en-US,en;q=0.5"),
+                ("Accept-Encoding", "gzip, deflate, br"),
+                ("Cookie", f"Authorization=Bearer {'x' * 160}"),
+            ],
+        )
+        s["client"] = (f"203.0.113.{rng.randrange(200)}", rng.randrange(1024, 65535))
+        s["query_string"] = rng.choice([b"", b"", b"page=2"])
+        result.append(Request(s))
+    return result
+
+
+def legacy(request: Request, received: int) -> tuple:
+    return (
+        received,
+        1_000_000,
+        str(request.method),
+        str(request.url),
+        str(request.headers),
+        str(request.query_params),
+        str(request.path_params),
+        str(request.client),
+        str(request.cookies),
+        200,
+        500_000,
+        1024,
+    )
+
+
+async def size(conn: aiosqlite.Connection) -> int:
+    result = 1
+    for pragma in ["page_size", "page_count"]:
+        async with conn.execute(f"PRAGMA {pragma};") as cursor:
+            result *= (await cursor.fetchone())[0]
+    return result
+
+
+async def store(database: Path, migrations, rows, encode) -> tuple[float, int]:
+    async with aiosqlite.connect(database) as conn:
+        for migration in migrations:
+            if isinstance(migration, str):
+                await conn.execute(migration)
+            else:
+                await migration(conn)
+        await conn.commit()
+        empty = await size(conn)
+        start = time.perf_counter_ns()
+        for i in range(0, len(rows), 500):
+            await encode(conn, rows[i : i + 500])
+            await conn.commit()
+        elapsed = time.perf_counter_ns() - start
+        return elapsed / len(rows), await size(conn) - empty
+
+
+async def main():
+    with TemporaryDirectory() as tmpdir:
+        tmp = Path(tmpdir)
+        settings = configure(tmp / "unused.sqlite3").requestlog
+        requestdb.allowed_headers = frozenset(settings.headers)
+        requestdb.redacted = frozenset(settings.redact)
+        rng = random.Random(0)
+        received = time.time_ns()
+        sample = requests(rng)
+        interned: dict[str, dict[str, int]] = {}
+
+        async def encode_legacy(conn, batch):
+            await conn.executemany(LEGACY_INSERT, [legacy(r, received) for r in batch])
+
+        async def encode_compact(conn, batch):
+            rows = [
+                requestdb._row(r, received, 1_000_000, 200, 500_000, 1024)
+                for r in batch
+            ]
+            await conn.executemany(
+                requestdb.INSERT, await requestdb.intern(conn, interned, rows)
+            )
+
+        for name, migrations, encode in [
+            ("legacy", requestdb.MIGRATIONS[:7], encode_legacy),
+            ("compact", requestdb.MIGRATIONS, encode_compact),
+        ]:
+            ns, grown = await store(tmp / f"{name}.sqlite3", migrations, sample, encode)
+            print(
+                f"{name:8} {grown / N:8.1f} bytes/row {ns / 1000:8.1f} us/row"
+                f" (encode + insert + index)"
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,114 @@
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+from importlib.util import find_spec
+from itertools import product
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from server import config, upgrade
+
+ROOT = Path(__file__).resolve().parent.parent
+LOOPS = ["asyncio", "uvloop"]
+PARSERS = ["h11", "httptools"]
+PATHS = ["/", "/login/", "/assets/missing.js"]
+CONNECTIONS = 32
+REQUESTS = 500
+
+
+def available(name: str) -> bool:
+    return name in ("asyncio", "h11") or find_spec(name) is not None
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def site(directory: Path, loop: str, http: str, port: int):
+    for name in ["public/index.html", "public/login/index.html"]:
+        (directory / "dist" / name).parent.mkdir(parents=True, exist_ok=True)
+        (directory / "dist" / name).write_text("<html>" + "x" * 2000 + "</html>")
+    (directory / "aidan.software.toml").write_text(
+        config.dumps_toml(
+            config.Config(
+                admin=config.Admin(username="bench", password_hash="bench"),
+                jwt=config.JWT(secret="bench"),
+                server=config.Server(host="127.0.0.1", port=port, loop=loop, http=http),
+            )
+        )
+    )
+
+
+def start(directory: Path) -> subprocess.Popen:
+    ready = directory / "ready"
+    process = subprocess.Popen(
+        [sys.executable, "-m", "server", "run"],
+        cwd=directory,
+        env=os.environ
+        | {"PYTHONPATH": str(ROOT), upgrade.READY_FILE: str(ready)},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while not ready.exists():
+        if process.poll() is not None or time.monotonic() > deadline:
+            raise RuntimeError("server failed to start")
+        time.sleep(0.05)
+    return process
+
+
+async def client(port: int, latencies: list[int]):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    for i in range(REQUESTS):
+        path = PATHS[i % len(PATHS)]
+        start = time.perf_counter_ns()
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: bench\r\n\r\n".encode())
+        head = await reader.readuntil(b"\r\n\r\n")
+        length = 0
+        for line in head.split(b"\r\n"):
+            name, _, value = line.partition(b":")
+            if name.lower() == b"content-length":
+                length = int(value)
+        await reader.readexactly(length)
+        latencies.append(time.perf_counter_ns() - start)
+    writer.close()
+    await writer.wait_closed()
+
+
+async def drive(port: int) -> tuple[float, list[int]]:
+    latencies: list[int] = []
+    await client(port, [])
+    start = time.perf_counter()
+    await asyncio.gather(*(client(port, latencies) for _ in range(CONNECTIONS)))
+    return len(latencies) / (time.perf_counter() - start), sorted(latencies)
+
+
+def main():
+    for loop, http in product(LOOPS, PARSERS):
+        if not (available(loop) and available(http)):
+            print(f"{loop:>8}/{http:<10} not installed, skipped")
+            continue
+        with TemporaryDirectory() as tmpdir:
+            port = free_port()
+            site(Path(tmpdir), loop, http, port)
+            process = start(Path(tmpdir))
+            try:
+                rate, latencies = asyncio.run(drive(port))
+            finally:
+                process.terminate()
+                process.wait()
+        p50 = latencies[len(latencies) // 2] / 1e6
+        p99 = latencies[len(latencies) * 99 // 100] / 1e6
+        print(
+            f"{loop:>8}/{http:<10} {rate:8.0f} req/s"
+            f"  p50 {p50:6.2f} ms  p99 {p99:6.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -2,18 +2,31 @@
 
 import subprocess
 import contextlib
+import gzip
+import hashlib
+import json
+from html.parser import HTMLParser
+import mimetypes
 import shutil
-import zipapp
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 
 from typer import Typer
 
 import server.__main__
+from server import staticfiles
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
-def sh(cmd, ck=True):
-    subprocess.run(cmd, shell=True, check=ck)
+
+def sh(cmd, ck=True, cwd=None):
+    subprocess.run(cmd, shell=True, check=ck, cwd=cwd)
 
 
 root_dir = Path.cwd()
@@ -23,6 +36,8 @@ public_dir = root_dir / "public"
 public_dist_dir = public_dir / "dist"
 dist_dir = root_dir / "dist"
 build_dir = root_dir / "build"
+cache_dir = root_dir / "build-cache"
+compressible = {".html", ".js", ".mjs", ".css", ".json", ".map", ".svg", ".txt"}
 
 cli = Typer()
 
@@ -40,6 +55,7 @@ def clean(
     dry: bool = False,
     build: bool = True,
     dist: bool = True,
+    cache: bool = False,
     caches: list[str] = ["__pycache__", ".mypy_cache", ".ruff_cache"],
 ):
     dirs = []
@@ -47,6 +63,8 @@ def clean(
         dirs.append(build_dir)
     if dist:
         dirs += [dist_dir, public_dist_dir, protected_dist_dir]
+    if cache:
+        dirs.append(cache_dir)
 
     for pattern in caches:
         for directory in root_dir.rglob(pattern):
@@ -59,38 +77,188 @@ def clean(
             shutil.rmtree(d, ignore_errors=True)
 
 
+def compress(directory: Path):
+    for path in directory.rglob("*"):
+        if path.suffix not in compressible or not path.is_file():
+            continue
+        data = path.read_bytes()
+        variants = {".gz": gzip.compress(data, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            variants[".br"] = brotli.compress(data, quality=11)
+        for suffix, compressed in variants.items():
+            if len(compressed) < len(data):
+                path.with_name(path.name + suffix).write_bytes(compressed)
+
+
+@contextlib.contextmanager
+def stage(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        print(f"[{name}] {time.perf_counter() - start:.2f}s")
+
+
+def digest(*paths: Path, exclude=frozenset({"node_modules", "dist"})) -> str:
+    h = hashlib.sha256()
+    for path in paths:
+        files = [path] if path.is_file() else sorted(path.rglob("*"))
+        for file in files:
+            name = file.relative_to(root_dir)
+            if not file.is_file() or exclude.intersection(name.parts):
+                continue
+            h.update(name.as_posix().encode() + b"\0")
+            h.update(file.read_bytes())
+    return h.hexdigest()[:16]
+
+
+def cached(kind: str, key: str, build) -> Path:
+    target = cache_dir / kind / key
+    if target.exists():
+        print(f"[{kind}] cached {key}")
+        return target
+    tmp = target.with_name(f"{key}.tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    with stage(f"{kind} {key}"):
+        build(tmp)
+    tmp.rename(target)
+    return target
+
+
+def node_modules(directory: Path):
+    key = digest(directory / "package-lock.json")
+    stamp = directory / "node_modules" / ".lockfile-digest"
+    if stamp.exists() and stamp.read_text() == key:
+        print(f"[{directory.name} node_modules] cached {key}")
+        return
+    with stage(f"{directory.name} node_modules"):
+        sh("npm ci", cwd=directory)
+    stamp.write_text(key)
+
+
+def frontend(directory: Path) -> Path:
+    def build(target: Path):
+        node_modules(directory)
+        sh("npm run build", cwd=directory)
+        shutil.copytree(directory / "dist", target, dirs_exist_ok=True)
+        shutil.rmtree(directory / "dist")
+        compress(target)
+
+    return cached(f"{directory.name}-dist", digest(directory), build)
+
+
+class Preloads(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.links: list[str] = []
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]):
+        a = dict(attrs)
+        href = a.get("src") if tag == "script" else a.get("href")
+        if not href or not href.startswith("/") or href.startswith("//"):
+            return
+        if (tag == "script" and a.get("type") == "module") or (
+            tag == "link" and a.get("rel") == "modulepreload"
+        ):
+            self.links.append(f"<{href}>; rel=modulepreload")
+        elif tag == "link" and a.get("rel") == "stylesheet":
+            self.links.append(f"<{href}>; rel=preload; as=style")
+
+
+def preloads(html: bytes) -> list[str]:
+    parser = Preloads()
+    parser.feed(html.decode("utf-8", errors="replace"))
+    return parser.links
+
+
+def manifest(directory: Path) -> dict[str, dict]:
+    entries = {}
+    for path in sorted(directory.rglob("*")):
+        variant = path.suffix in {".gz", ".br"} and path.with_suffix("").exists()
+        if not path.is_file() or variant:
+            continue
+        name = path.relative_to(directory).as_posix()
+        data = path.read_bytes()
+        entries[name] = {
+            "hash": hashlib.sha256(data).hexdigest()[:16],
+            "size": len(data),
+            "type": mimetypes.guess_type(name)[0],
+            "cache": staticfiles.classify(name),
+        }
+        if path.suffix == ".html":
+            entries[name]["preload"] = preloads(data)
+    return entries
+
+
 @cli.command()
 def buildstatic():
-    clean()
-    with contextlib.chdir(protected_dir):
-        sh("npm ci")
-        sh("npm run build")
-    with contextlib.chdir(public_dir):
-        sh("npm ci")
-        sh("npm run build")
+    with stage("buildstatic"):
+        with ThreadPoolExecutor(2) as pool:
+            protected, public = pool.map(frontend, [protected_dir, public_dir])
+        staging = dist_dir.with_name("dist.new")
+        shutil.rmtree(staging, ignore_errors=True)
+        shutil.copytree(protected, staging / "protected")
+        shutil.copytree(public, staging / "public")
+        (staging / staticfiles.MANIFEST).write_text(
+            json.dumps(manifest(staging), indent=1)
+        )
+        if dist_dir.exists():
+            old = dist_dir.rename(dist_dir.with_name("dist.old"))
+            staging.rename(dist_dir)
+            shutil.rmtree(old)
+        else:
+            staging.rename(dist_dir)
 
-    dist_dir.mkdir(exist_ok=True)
-    shutil.move(protected_dir / "dist", dist_dir / "protected")
-    shutil.move(public_dir / "dist", dist_dir / "public")
 
+def pydeps() -> Path:
+    def build(target: Path):
+        requirements = target.with_suffix(".txt")
+        sh(f"python -m poetry export -f requirements.txt --output {requirements}")
+        sh(f"python -m pip install -r {requirements} -t {target}")
+        requirements.unlink()
 
-@cli.command()
-def buildpyz():
-    buildstatic()
-    build_dir.mkdir(exist_ok=True)
-    shutil.copytree(root_dir / "server", build_dir / "server")
-    shutil.copytree(dist_dir / "protected", build_dir / "protected")
-    shutil.copytree(dist_dir / "public", build_dir / "public")
-    sh("python -m poetry export -f requirements.txt --output requirements.txt")
-    sh(f"python -m pip install -r requirements.txt -t {build_dir}")
-    (root_dir / "requirements.txt").unlink()
-    zipapp.create_archive(
-        build_dir,
-        "aidan.software.pyz",
-        interpreter="/usr/bin/env python",
-        main="server.__main__:cli",
+    return cached(
+        "pydeps", digest(root_dir / "pyproject.toml", root_dir / "poetry.lock"), build
     )
-    shutil.rmtree(build_dir)
+
+
+def archive(source: Path, target: Path, compress: bool):
+    with open(target, "wb") as f:
+        f.write(b"#!/usr/bin/env python\n")
+        with zipfile.ZipFile(f, "w") as pyz:
+            for path in sorted(source.rglob("*")):
+                name = path.relative_to(source).as_posix()
+                static = name.startswith(("public/", "protected/"))
+                pyz.write(
+                    path,
+                    name,
+                    zipfile.ZIP_DEFLATED if compress and not static else None,
+                )
+            pyz.writestr(
+                "__main__.py", "import server.__main__\nserver.__main__.cli()\n"
+            )
+    target.chmod(0o755)
+
+
+@cli.command()
+def buildpyz(compress: bool = False, static: bool = True):
+    if static:
+        buildstatic()
+    with stage("buildpyz"):
+        shutil.rmtree(build_dir, ignore_errors=True)
+        shutil.copytree(pydeps(), build_dir)
+        shutil.copytree(
+            root_dir / "server",
+            build_dir / "server",
+            ignore=shutil.ignore_patterns("__pycache__"),
+        )
+        shutil.copytree(dist_dir / "protected", build_dir / "protected")
+        shutil.copytree(dist_dir / "public", build_dir / "public")
+        shutil.copy(dist_dir / staticfiles.MANIFEST, build_dir / staticfiles.MANIFEST)
+        with stage("archive"):
+            archive(build_dir, root_dir / "aidan.software.pyz", compress)
+        shutil.rmtree(build_dir)
 
 
 if __name__ == "__main__":
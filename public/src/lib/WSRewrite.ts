@@ -34,6 +34,10 @@ export default class WSRewrite {
     this.ws.onclose = onclose;
     this.ws.onmessage = (event) => {
       let [command, data] = parseCommand(event.data);
+      if (command === "PING") {
+        this.ws.send("PONG");
+        return;
+      }
       oncommand(command, data);
     };
   }
@@ -1,9 +1,12 @@
+import json
+import sys
+from datetime import datetime
 from pathlib import Path
 
 from rich import print
 from typer import Typer
 
-from server import config, core
+from server import config, core, requestdb
 
 cli = Typer()
 
@@ -25,5 +28,16 @@ def checkconfig(path: Path = Path("aidan.software.toml")):
     print(config.read(path))
 
 
+@cli.command()
+def export(since: datetime | None = None):
+    core.load()
+    for record in requestdb.records(
+        core.config.locations.database,
+        core.config.locations.segments,
+        int(since.timestamp() * 1e9) if since else 0,
+    ):
+        sys.stdout.write(json.dumps(record) + "\n")
+
+
 if __name__ == "__main__":
     cli()
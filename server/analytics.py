@@ -0,0 +1,100 @@
+import time
+from collections import defaultdict
+from datetime import timedelta
+from typing import Literal
+
+from fastapi import APIRouter, Query
+
+from . import requestdb
+from .auth import Auth
+
+api = APIRouter(prefix="/api/analytics")
+PERCENTILES = (50, 90, 99)
+INTERNED = {"path": "paths", "agent": "agents"}
+
+
+def since(window: timedelta) -> int:
+    return time.time_ns() - int(window.total_seconds() * 1e9)
+
+
+def percentiles(bins: list[tuple[int, float]]) -> dict[str, float]:
+    total = sum(n for _, n in bins)
+    result = {}
+    for p in PERCENTILES:
+        rank, seen = total * p / 100, 0
+        for bin, n in bins:
+            seen += n
+            if seen >= rank:
+                result[f"p{p}_ms"] = requestdb.bin_latency(bin) / 1e6
+                break
+    return result
+
+
+@api.get("/routes")
+async def routes(auth: Auth, window: timedelta = timedelta(days=1)):
+    bins: defaultdict[str, list[tuple[int, float]]] = defaultdict(list)
+    stats: defaultdict[str, dict] = defaultdict(
+        lambda: {"count": 0, "errors": 0, "elapsed_ns": 0}
+    )
+    async with requestdb.reader.execute(
+        "SELECT route, bin, SUM(count), SUM(errors), SUM(elapsed_ns) FROM rollup"
+        " WHERE bucket >= ? GROUP BY route, bin ORDER BY route, bin;",
+        (since(window) // requestdb.BUCKET_NS,),
+    ) as cursor:
+        async for route, bin, count, errors, elapsed in cursor:
+            bins[route].append((bin, count))
+            stats[route]["count"] += count
+            stats[route]["errors"] += errors
+            stats[route]["elapsed_ns"] += elapsed
+    return [
+        {
+            "route": route,
+            "count": round(s["count"]),
+            "errors": round(s["errors"]),
+            "mean_ms": s["elapsed_ns"] / s["count"] / 1e6,
+            **percentiles(bins[route]),
+        }
+        for route, s in sorted(stats.items(), key=lambda i: -i[1]["count"])
+    ]
+
+
+@api.get("/traffic")
+async def traffic(
+    auth: Auth,
+    window: timedelta = timedelta(days=1),
+    bucket: timedelta = timedelta(hours=1),
+):
+    width = max(int(bucket.total_seconds() * 1e9) // requestdb.BUCKET_NS, 1)
+    async with requestdb.reader.execute(
+        "SELECT bucket / ? * ?, SUM(count), SUM(errors) FROM rollup"
+        " WHERE bucket >= ? GROUP BY 1 ORDER BY 1;",
+        (width, width, since(window) // requestdb.BUCKET_NS),
+    ) as cursor:
+        return [
+            {
+                "start": start * requestdb.BUCKET_NS // 1_000_000_000,
+                "count": round(n),
+                "errors": round(e),
+            }
+            async for start, n, e in cursor
+        ]
+
+
+@api.get("/top/{field}")
+async def top(
+    auth: Auth,
+    field: Literal["client", "path", "agent"],
+    window: timedelta = timedelta(days=1),
+    limit: int = Query(10, le=1000),
+):
+    query = (
+        f"SELECT {field}, SUM(weight) AS n FROM requests WHERE received_ts_ns >= ?"
+        " GROUP BY 1 ORDER BY n DESC LIMIT ?"
+    )
+    if field in INTERNED:
+        query = (
+            f"SELECT value, n FROM ({query}) AS top"
+            f" LEFT JOIN {INTERNED[field]} ON id = top.{field} ORDER BY n DESC"
+        )
+    async with requestdb.reader.execute(query, (since(window), limit)) as cursor:
+        return [{field: value, "count": round(n)} async for value, n in cursor]
@@ -1,29 +1,108 @@
 import logging
 from contextlib import asynccontextmanager
+from datetime import timedelta
+from typing import Literal
 
 import uvicorn
 from fastapi import FastAPI
+from starlette.types import ASGIApp, Receive, Scope, Send
 
-from . import auth, livecontrol, requestdb, staticfiles, webhook
+from . import (
+    analytics,
+    auth,
+    core,
+    livecontrol,
+    metrics,
+    requestdb,
+    staticfiles,
+    upgrade,
+    webhook,
+)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    if not hasattr(core, "config"):
+        core.load()
     try:
         await requestdb.opendb()
+        await staticfiles.openloader()
+        await livecontrol.openmanager()
+        upgrade.ready()
         yield
     finally:
+        await livecontrol.closemanager()
+        await staticfiles.closeloader()
         await requestdb.closedb()
 
 
+class UnixForwarded:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if (
+            scope["type"] in ("http", "websocket")
+            and not scope.get("client")
+            and (client := forwarded_client(scope["headers"])) is not None
+        ):
+            scope["client"] = (client, 0)
+        await self.app(scope, receive, send)
+
+
+def forwarded_client(headers: list[tuple[bytes, bytes]]) -> str | None:
+    settings = core.config.server
+    if not settings.proxy_headers:
+        return None
+    trusted = {host.strip() for host in settings.forwarded_allow_ips.split(",")}
+    hosts = [
+        host.strip()
+        for name, value in headers
+        if name == b"x-forwarded-for"
+        for host in value.decode("latin1").split(",")
+    ]
+    for host in reversed(hosts):
+        if host and host not in trusted:
+            return host
+    return None
+
+
 api = FastAPI(lifespan=lifespan)
 api.add_middleware(requestdb.LogRequests)
+api.add_middleware(metrics.Instrument, routes=api.routes)
+api.add_middleware(UnixForwarded)
 api.include_router(webhook.api)
 api.add_exception_handler(auth.AuthenticationError, auth.RedirectForLogin())
 api.include_router(auth.api)
 api.include_router(livecontrol.api)
+api.include_router(analytics.api)
+api.include_router(metrics.api)
 api.include_router(staticfiles.api)
 
 
+def seconds(value: timedelta | Literal[False]) -> float | None:
+    return value.total_seconds() if value else None
+
+
 def run():
-    uvicorn.run(api, host="0.0.0", port=8000, log_level=logging.INFO)
+    settings = core.config.server
+    listener = upgrade.listen(
+        settings.host, settings.port, settings.uds or None, settings.backlog
+    )
+    if settings.workers > 1:
+        upgrade.supervise(settings.bus / "upgrade", settings.workers)
+    uvicorn.run(
+        "server.api:api" if settings.workers > 1 else api,
+        fd=listener.fileno(),
+        workers=settings.workers,
+        loop=settings.loop,
+        http=settings.http,
+        proxy_headers=settings.proxy_headers,
+        forwarded_allow_ips=settings.forwarded_allow_ips,
+        backlog=settings.backlog,
+        timeout_keep_alive=int(settings.keep_alive.total_seconds()),
+        limit_concurrency=settings.limit_concurrency or None,
+        ws_ping_interval=seconds(settings.ws_ping_interval),
+        ws_ping_timeout=seconds(settings.ws_ping_timeout),
+        log_level=logging.INFO,
+    )
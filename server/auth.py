@@ -1,17 +1,25 @@
+import asyncio
 import logging
+import math
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from typing import Annotated, TypeAlias
 
 from fastapi import APIRouter, Cookie, Depends, HTTPException, Request
 from fastapi.responses import RedirectResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 
-from . import auth_backends, core
+from . import auth_backends, core, instruments
 
 log = logging.getLogger(__name__)
 hasher = auth_backends.hasher()
 tokenizer = auth_backends.tokenizer()
 api = APIRouter()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login", auto_error=False)
+hash_time = instruments.Histogram(
+    "aidan_login_hash_seconds", "Password hash verification time."
+)
 
 
 class AuthenticationError(HTTPException):
@@ -34,17 +42,99 @@ class Authentication:
 Auth: TypeAlias = Annotated[str, Depends(Authentication())]
 
 
+class LoginThrottle:
+    def __init__(self, workers: int, concurrency: int, attempts: int, window: float):
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="login")
+        self.concurrency = concurrency
+        self.attempts = attempts
+        self.window = window
+        self.inflight = 0
+        self.history: dict[str, deque[float]] = {}
+
+    def admit(self, client: str):
+        now = time.monotonic()
+        if len(self.history) > 10_000:
+            self.prune(now)
+        history = self.history.setdefault(client, deque())
+        while history and history[0] <= now - self.window:
+            history.popleft()
+        if len(history) >= self.attempts:
+            retry = math.ceil(history[0] + self.window - now)
+            raise HTTPException(
+                status_code=429,
+                detail="Too many login attempts.",
+                headers={"Retry-After": str(retry)},
+            )
+        history.append(now)
+
+    def prune(self, now: float):
+        for client, history in list(self.history.items()):
+            if not history or history[-1] <= now - self.window:
+                del self.history[client]
+
+    async def check(self, password: str, password_hash: str) -> bool:
+        if self.inflight >= self.concurrency:
+            raise HTTPException(
+                status_code=503,
+                detail="Too many logins in progress.",
+                headers={"Retry-After": "1"},
+            )
+        self.inflight += 1
+        try:
+            valid, elapsed = await asyncio.get_running_loop().run_in_executor(
+                self.executor, verify, password, password_hash
+            )
+        finally:
+            self.inflight -= 1
+        hash_time.observe(elapsed)
+        return valid
+
+
+def verify(password: str, password_hash: str) -> tuple[bool, float]:
+    start = time.perf_counter()
+    return hasher.check(password, password_hash), time.perf_counter() - start
+
+
+_throttle: LoginThrottle
+
+
+def throttle() -> LoginThrottle:
+    global _throttle
+    try:
+        return _throttle
+    except NameError:
+        settings = core.config.login
+        _throttle = LoginThrottle(
+            settings.workers,
+            settings.concurrency,
+            settings.attempts,
+            settings.window.total_seconds(),
+        )
+        return _throttle
+
+
 class LoginRequest:
-    def __init__(self, form: Annotated[OAuth2PasswordRequestForm, Depends()]):
+    def __init__(
+        self,
+        request: Request,
+        form: Annotated[OAuth2PasswordRequestForm, Depends()],
+    ):
         self.username = form.username
         self.password = form.password
         self.scopes = form.scopes
-        self.authenticated = self.authenticate()
-
-    def authenticate(self) -> str:
+        self.client = request.client.host if request.client else None
+
+    async def authenticate(self) -> str:
+        if not self.client:
+            core.log.error(
+                "Rejected login without a client address. Behind a unix socket,"
+                " the proxy must send X-Forwarded-For."
+            )
+            raise HTTPException(status_code=400, detail="Client address unknown.")
+        throttle().admit(self.client)
         if not (
             self.username == core.config.admin.username
-            and hasher.check(self.password, core.config.admin.password_hash)
+            and await throttle().check(self.password, core.config.admin.password_hash)
         ):
             raise HTTPException(status_code=401, detail="Invalid credentials.")
         return tokenizer.tokenize(
@@ -63,4 +153,4 @@ class RedirectForLogin:
 
 @api.post("/login")
 async def authenticate(login: Annotated[LoginRequest, Depends()]):
-    return {"access_token": login.authenticate(), "token_type": "bearer"}
+    return {"access_token": await login.authenticate(), "token_type": "bearer"}
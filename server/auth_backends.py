@@ -2,6 +2,8 @@ import binascii
 import hashlib
 import logging
 import os
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
 
 import jwt  # PyJWT: https://github.com/jpadilla/pyjwt
@@ -60,6 +62,13 @@ class HashlibSHA512:
 
 
 class PyJWT:
+    def __init__(self, cache_size: int = 1024):
+        self.cache_size = cache_size
+        self.verified: OrderedDict[bytes, float] = OrderedDict()
+        self.secret: str | None = None
+        self.hits = 0
+        self.misses = 0
+
     def tokenize(self, data: dict[str, str], secret: str, ttl: timedelta):
         return jwt.encode(
             data | {"exp": round((datetime.now() + ttl).timestamp())},
@@ -67,12 +76,41 @@ class PyJWT:
             algorithm="HS256",
         )
 
+    def invalidate(self):
+        self.verified.clear()
+
     def check(self, token: str, secret: str) -> bool:
+        if secret != self.secret:
+            self.invalidate()
+            self.secret = secret
+        key = hashlib.blake2b(token.encode("utf-8"), digest_size=16).digest()
+        exp = self.verified.get(key)
+        if exp is not None:
+            if time.time() < exp:
+                self.hits += 1
+                self.verified.move_to_end(key)
+                return True
+            del self.verified[key]
+        self.misses += 1
         try:
-            return bool(jwt.decode(token, secret, algorithms=["HS256"]))
+            payload = jwt.decode(token, secret, algorithms=["HS256"])
         except jwt.DecodeError:
             log.info("Invalid token.")
             return False
         except jwt.ExpiredSignatureError:
             log.info("Expired token.")
             return False
+        if "exp" in payload:
+            self.verified[key] = payload["exp"]
+            while len(self.verified) > self.cache_size:
+                self.verified.popitem(last=False)
+        return bool(payload)
+
+    def stats(self) -> dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self.verified),
+            "hit_rate": self.hits / total if total else 0.0,
+        }
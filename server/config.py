@@ -6,7 +6,7 @@ from pathlib import Path
 from typing import Literal
 
 import tomli_w
-from pydantic import BaseModel, Field, parse_obj_as
+from pydantic import BaseModel, Field, model_validator, parse_obj_as
 
 from . import auth_backends
 
@@ -21,6 +21,21 @@ class JWT(BaseModel):
     ttl: timedelta = timedelta(days=30)
 
 
+class Login(BaseModel):
+    workers: int = 2
+    concurrency: int = 4
+    attempts: int = 10
+    window: timedelta = timedelta(minutes=5)
+
+
+class LiveControl(BaseModel):
+    queue_size: int = 32
+    slow_consumer: Literal["drop", "coalesce", "disconnect"] = "coalesce"
+    ping_interval: timedelta = timedelta(seconds=20)
+    ping_timeout: timedelta = timedelta(seconds=10)
+    bus_timeout: timedelta = timedelta(seconds=2)
+
+
 class Rebuild(BaseModel):
     secret: str
     branch: str | None = None
@@ -31,13 +46,83 @@ class Rebuild(BaseModel):
 class Locations(BaseModel):
     static: Path = Path("dist")
     database: Path = Path("aidan.software.sqlite3")
+    build: Path = Path("aidan.software.build")
+    segments: Path | Literal[False] = False
+
+
+class StaticFiles(BaseModel):
+    cache_bytes: int = 64 * 1024 * 1024
+    poll_interval: timedelta = timedelta(seconds=2)
+
+
+class CaptureRule(BaseModel):
+    prefix: str
+    sample: float = 1.0
+
+
+class RequestLog(BaseModel):
+    queue_size: int = 10_000
+    batch_size: int = 500
+    flush_interval: timedelta = timedelta(seconds=1)
+    overflow: Literal["drop-oldest", "block"] = "drop-oldest"
+    max_age: timedelta | Literal[False] = timedelta(days=90)
+    max_rows: int | Literal[False] = False
+    retention_interval: timedelta = timedelta(hours=1)
+    delete_batch: int = 1000
+    segment_bytes: int = 4 * 1024 * 1024
+    segment_interval: timedelta = timedelta(seconds=10)
+    headers: list[str] = [
+        "host",
+        "referer",
+        "accept-language",
+        "content-type",
+        "x-forwarded-for",
+    ]
+    redact: list[str] = ["authorization", "cookie", "token", "password", "secret"]
+    capture: list[CaptureRule] = [
+        CaptureRule(prefix="/assets/", sample=0.01),
+        CaptureRule(prefix="/admin/assets/", sample=0.01),
+    ]
+    always_status: int = 400
+    always_slow: timedelta = timedelta(seconds=1)
+
+
+class Server(BaseModel):
+    host: str = "0.0.0.0"
+    port: int = 8000
+    uds: Path | Literal[False] = False
+    proxy_headers: bool = True
+    forwarded_allow_ips: str = "127.0.0.1,::1"
+    loop: Literal["auto", "asyncio", "uvloop"] = "auto"
+    http: Literal["auto", "h11", "httptools"] = "auto"
+    backlog: int = 2048
+    keep_alive: timedelta = timedelta(seconds=5)
+    limit_concurrency: int | Literal[False] = False
+    ws_ping_interval: timedelta | Literal[False] = timedelta(seconds=20)
+    ws_ping_timeout: timedelta | Literal[False] = timedelta(seconds=20)
+    workers: int = 1
+    bus: Path = Path("aidan.software.bus")
+
+    @model_validator(mode="after")
+    def addressable(self) -> "Server":
+        if self.uds and not self.proxy_headers:
+            raise ValueError(
+                "uds requires proxy_headers: login throttling needs the client"
+                " address from the proxy's X-Forwarded-For header."
+            )
+        return self
 
 
 class Config(BaseModel):
     admin: Admin
     jwt: JWT
     rebuild: Rebuild | Literal[False] = False
+    login: Login = Field(default_factory=Login)
+    livecontrol: LiveControl = Field(default_factory=LiveControl)
     locations: Locations = Field(default_factory=Locations)
+    requestlog: RequestLog = Field(default_factory=RequestLog)
+    staticfiles: StaticFiles = Field(default_factory=StaticFiles)
+    server: Server = Field(default_factory=Server)
     zipapp: bool = sys.argv[0].endswith("pyz")
 
 
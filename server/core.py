@@ -2,7 +2,7 @@ import logging
 
 from rich.logging import RichHandler
 
-from .api import run
+from . import auth
 from .config import Config, locate
 
 log = logging.getLogger(__name__)
@@ -12,7 +12,14 @@ log.setLevel(logging.INFO)
 config: Config
 
 
-def start():
+def load():
     global config
     config = locate("aidan.software")
+    auth.tokenizer.invalidate()
+
+
+def start():
+    from .api import run
+
+    load()
     run()
@@ -0,0 +1,153 @@
+import math
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from collections.abc import Callable, Iterable, Iterator
+
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+registry: list["Metric"] = []
+Collected = list[tuple[str, str, str, list[tuple[str, str, float]]]]
+
+
+def labels(**values: str) -> str:
+    if not values:
+        return ""
+    escaped = (
+        (k, str(v).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n"))
+        for k, v in values.items()
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def number(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value)
+
+
+class Metric(ABC):
+    kind: str
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        registry.append(self)
+
+    @abstractmethod
+    def samples(self) -> Iterator[tuple[str, str, float]]: ...
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(
+        self, name: str, help: str, collect: Callable[[], float] | None = None
+    ):
+        super().__init__(name, help)
+        self.value = 0
+        self.collect = collect
+
+    def inc(self, n: int = 1):
+        self.value += n
+
+    def samples(self) -> Iterator[tuple[str, str, float]]:
+        yield "", "", self.value if self.collect is None else self.collect()
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+
+class Series:
+    __slots__ = ("buckets", "counts", "sum")
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        label: str | None = None,
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, help)
+        self.label = label
+        self.buckets = buckets
+        self.series: dict[str, Series] = {} if label else {"": Series(buckets)}
+
+    def observe(self, value: float):
+        self.series[""].observe(value)
+
+    def labels(self, value: str) -> Series:
+        try:
+            return self.series[value]
+        except KeyError:
+            series = self.series[value] = Series(self.buckets)
+            return series
+
+    def preallocate(self, values: Iterable[str]):
+        for value in values:
+            self.labels(value)
+
+    def samples(self) -> Iterator[tuple[str, str, float]]:
+        bounds = (*self.buckets, math.inf)
+        for value, series in list(self.series.items()):
+            base = {self.label: value} if self.label else {}
+            total = 0
+            for bound, n in zip(bounds, series.counts):
+                total += n
+                yield "_bucket", labels(**base, le=number(bound)), total
+            yield "_sum", labels(**base), series.sum
+            yield "_count", labels(**base), total
+
+
+def collect() -> Collected:
+    return [(m.name, m.help, m.kind, list(m.samples())) for m in registry]
+
+
+def merge(*collections: Collected) -> Collected:
+    merged: dict[str, tuple[str, str, dict[tuple[str, str], float]]] = {}
+    for collected in collections:
+        for name, help, kind, samples in collected:
+            _, _, values = merged.setdefault(name, (help, kind, {}))
+            for suffix, label, value in samples:
+                values[suffix, label] = values.get((suffix, label), 0) + value
+    return [
+        (name, help, kind, [(*key, value) for key, value in values.items()])
+        for name, (help, kind, values) in merged.items()
+    ]
+
+
+def render(collected: Collected | None = None) -> str:
+    lines = []
+    for name, help, kind, samples in collect() if collected is None else collected:
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {kind}")
+        for suffix, label, value in samples:
+            lines.append(f"{name}{suffix}{label} {number(value)}")
+    return "\n".join(lines) + "\n"
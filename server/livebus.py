@@ -0,0 +1,150 @@
+import asyncio
+import contextlib
+import json
+import logging
+import os
+from pathlib import Path
+
+from fastapi import HTTPException
+
+from . import instruments
+from .wsmanager import WSManager
+
+log = logging.getLogger(__name__)
+
+
+class LiveBus:
+    def __init__(
+        self,
+        directory: Path,
+        manager: WSManager,
+        name: str | None = None,
+        timeout: float = 2.0,
+    ):
+        self.directory = directory
+        self.manager = manager
+        self.name = name or str(os.getpid())
+        self.timeout = timeout
+        self.path = directory / f"{self.name}.sock"
+        self.server: asyncio.AbstractServer | None = None
+
+    async def start(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.path.unlink(missing_ok=True)
+        self.manager.prefix = f"{self.name}."
+        self.server = await asyncio.start_unix_server(self.handle, path=self.path)
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        self.path.unlink(missing_ok=True)
+
+    def peers(self) -> list[Path]:
+        return [p for p in self.directory.glob("*.sock") if p != self.path]
+
+    def owner(self, uid: str) -> str:
+        return uid.partition(".")[0]
+
+    def local(self, message: dict) -> dict:
+        match message["op"]:
+            case "dispatch":
+                try:
+                    uids = self.manager.dispatch(
+                        message["command"], message["content"], message["uids"]
+                    )
+                except HTTPException as e:
+                    return {"status": e.status_code}
+                return {"status": 200, "uids": uids}
+            case "state":
+                return {"status": 200, "state": self.manager.state}
+            case "metrics":
+                return {"status": 200, "metrics": instruments.collect()}
+        return {"status": 400}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while line := await reader.readline():
+                writer.write(json.dumps(self.local(json.loads(line))).encode() + b"\n")
+                await writer.drain()
+        except (ConnectionError, json.JSONDecodeError, KeyError):
+            log.exception("Bad message on live-control bus.")
+        finally:
+            writer.close()
+
+    async def request(self, peer: Path, message: dict) -> dict:
+        try:
+            async with asyncio.timeout(self.timeout):
+                return await self.exchange(peer, message)
+        except TimeoutError:
+            log.warning(f"Timed out waiting for live-control bus peer {peer}.")
+            return {"status": 502}
+
+    async def exchange(self, peer: Path, message: dict) -> dict:
+        try:
+            reader, writer = await asyncio.open_unix_connection(peer)
+        except ConnectionRefusedError:
+            log.info(f"Removing stale live-control bus socket {peer}.")
+            peer.unlink(missing_ok=True)
+            return {"status": 404}
+        except FileNotFoundError:
+            return {"status": 404}
+        try:
+            writer.write(json.dumps(message).encode() + b"\n")
+            await writer.drain()
+            return json.loads(await reader.readline())
+        except (ConnectionError, ValueError):
+            log.warning(f"No reply from live-control bus peer {peer}.")
+            return {"status": 502}
+        finally:
+            writer.close()
+            with contextlib.suppress(ConnectionError):
+                await writer.wait_closed()
+
+    async def dispatch(
+        self, command: str, content: str = "", uids: list[str] | None = None
+    ) -> dict[str, list[str]]:
+        message = {"op": "dispatch", "command": command, "content": content}
+        peers = {p.stem: p for p in self.peers()}
+        requests: dict[str, list[str] | None] = {}
+        if uids is None:
+            dispatched = self.manager.dispatch(command, content)
+            requests = dict.fromkeys(peers)
+        else:
+            for uid in uids:
+                requests.setdefault(self.owner(uid), []).append(uid)
+            local = requests.pop(self.name, None)
+            dispatched = self.manager.dispatch(command, content, local) if local else []
+        unreachable = [owner for owner in requests if owner not in peers]
+        requests = {o: u for o, u in requests.items() if o in peers}
+        replies = await asyncio.gather(
+            *(
+                self.request(peers[owner], message | {"uids": u})
+                for owner, u in requests.items()
+            )
+        )
+        for owner, reply in zip(requests, replies):
+            if reply["status"] == 200:
+                dispatched += reply.get("uids", [])
+            elif uids is not None or reply["status"] != 404:
+                unreachable.append(owner)
+        return {"dispatched": dispatched, "unreachable": unreachable}
+
+    async def state(self) -> dict[str, tuple[bool, str]]:
+        replies = await asyncio.gather(
+            *(self.request(p, {"op": "state"}) for p in self.peers())
+        )
+        state = dict(self.manager.state)
+        for reply in replies:
+            for uid, (active, content) in reply.get("state", {}).items():
+                state[uid] = (active, content)
+        return state
+
+    async def metrics(self) -> instruments.Collected:
+        replies = await asyncio.gather(
+            *(self.request(p, {"op": "metrics"}) for p in self.peers())
+        )
+        return instruments.merge(
+            instruments.collect(), *(r.get("metrics", []) for r in replies)
+        )
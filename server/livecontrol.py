@@ -1,36 +1,91 @@
-import asyncio
 import logging
 
 from fastapi import APIRouter, Response, WebSocket, WebSocketDisconnect
-from pydantic import BaseModel
+from pydantic import BaseModel, model_validator
 
+from . import core, instruments
 from .auth import Auth
+from .livebus import LiveBus
 from .wsmanager import WSManager
 
 log = logging.getLogger(__name__)
 api: APIRouter = APIRouter()
 manager = WSManager()
+bus: LiveBus | None = None
+instruments.Gauge(
+    "aidan_live_connections",
+    "Open live-control websockets.",
+    lambda: len(manager.connections),
+)
+instruments.Gauge(
+    "aidan_live_queue_depth",
+    "Messages waiting in live-control send queues.",
+    lambda: sum(len(c.queue) for c in manager.connections.values()),
+)
 
 
 class Command(BaseModel):
     command: str
-    uid: str
+    uid: str | None = None
+    uids: list[str] | None = None
     content: str = ""
+    all: bool = False
+
+    @model_validator(mode="after")
+    def addressed(self) -> "Command":
+        if self.all == (self.uid is None and not self.uids):
+            return self
+        raise ValueError("Address a command to uid/uids or to all, not both.")
+
+    def targets(self) -> list[str] | None:
+        if self.all:
+            return None
+        if self.uid is not None:
+            return [self.uid, *(self.uids or [])]
+        return self.uids
+
+
+async def openmanager():
+    global bus
+    settings = core.config.livecontrol
+    manager.start(
+        settings.ping_interval.total_seconds(), settings.ping_timeout.total_seconds()
+    )
+    if core.config.server.workers > 1:
+        bus = LiveBus(
+            core.config.server.bus,
+            manager,
+            timeout=settings.bus_timeout.total_seconds(),
+        )
+        await bus.start()
+
+
+async def closemanager():
+    global bus
+    if bus is not None:
+        await bus.stop()
+        bus = None
+    await manager.stop(1012)
 
 
 @api.websocket("/api/live")
 async def ws_connect(websocket: WebSocket):
     uid = await manager.connect(websocket)
-    while uid in manager.connections:
-        try:
-            await websocket.receive_text()
-        except WebSocketDisconnect:
-            manager.disconnect(uid)
-        await asyncio.sleep(0.5)
+    if uid is None:
+        return
+    try:
+        async for _ in websocket.iter_text():
+            manager.seen(uid)
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        manager.disconnect(uid)
 
 
 @api.get("/api/state")
 async def active(auth: Auth, response: Response):
+    if bus is not None:
+        return await bus.state()
     return manager.state
 
 
@@ -41,10 +96,11 @@ async def dispatch_command(
     response: Response,
 ):
     log.info(f"Dispatching {command}")
-    match command.command:
-        case "ACTIVATE":
-            await manager.activate(command.uid)
-        case "UPDATE":
-            await manager.update(command.uid, command.content)
-        case "DEACTIVATE":
-            await manager.deactivate(command.uid)
+    if bus is not None:
+        return await bus.dispatch(command.command, command.content, command.targets())
+    return {
+        "dispatched": manager.dispatch(
+            command.command, command.content, command.targets()
+        ),
+        "unreachable": [],
+    }
@@ -0,0 +1,46 @@
+import time
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from starlette.routing import Route
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from . import livecontrol
+from .auth import Auth
+from .instruments import Gauge, Histogram, render
+from .requestdb import UNMATCHED, template
+
+api = APIRouter()
+inflight = Gauge("aidan_http_requests_in_flight", "HTTP requests being handled.")
+latency = Histogram(
+    "aidan_http_request_duration_seconds",
+    "HTTP request latency by route.",
+    label="route",
+)
+
+
+class Instrument:
+    def __init__(self, app: ASGIApp, routes: list):
+        self.app = app
+        latency.preallocate(
+            [UNMATCHED] + [r.path for r in routes if isinstance(r, Route)]
+        )
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter_ns()
+        inflight.value += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            inflight.value -= 1
+            latency.labels(template(scope)).observe(
+                (time.perf_counter_ns() - start) / 1e9
+            )
+
+
+@api.get("/api/metrics")
+async def metrics(auth: Auth):
+    collected = None if livecontrol.bus is None else await livecontrol.bus.metrics()
+    return PlainTextResponse(render(collected), media_type="text/plain; version=0.0.4")
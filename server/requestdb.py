@@ -1,19 +1,144 @@
+import asyncio
+import contextlib
+import itertools
+import json
+import logging
+import math
+import os
+import random
+import re
+import sqlite3
 import time
+from collections import defaultdict, deque
+from collections.abc import Awaitable, Callable, Iterable, Iterator
+from pathlib import Path
+from typing import Literal, TextIO
+from urllib.parse import parse_qsl, urlsplit
 
 import aiosqlite
 from fastapi import Request
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
-from . import core
+from . import core, instruments
 
+log = logging.getLogger(__name__)
 db: aiosqlite.Connection
+reader: aiosqlite.Connection
+writer: "BatchWriter | SegmentWriter"
+retention_task: asyncio.Task
+compactor_task: asyncio.Task | None = None
+compactor_stop: asyncio.Event
+transaction: asyncio.Lock
+flush_time = instruments.Histogram(
+    "aidan_requestlog_flush_seconds", "Time to write a batch of logged requests."
+)
+BUCKET_NS = 60 * 1_000_000_000
+BINS_PER_OCTAVE = 8
 
+INSERT = (
+    "INSERT INTO requests("
+    "received_ts_ns,"
+    "elapsed_ns,"
+    "method,"
+    "path,"
+    "query,"
+    "agent,"
+    "client,"
+    "headers,"
+    "cookies,"
+    "status,"
+    "ttfb_ns,"
+    "bytes_sent,"
+    "weight"
+    ") VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);"
+)
+INTERNED = {2: "methods", 3: "paths", 5: "agents"}
+UNMATCHED = "unmatched"
+INTERN_CACHE_SIZE = 10_000
+REDACTED = "<redacted>"
+LEGACY_CLIENT = re.compile(r"host='([^']*)'")
+LEGACY_AGENT = re.compile(r"'user-agent': '([^']*)'")
+allowed_headers: frozenset[str] = frozenset()
+redacted: frozenset[str] = frozenset()
+capture: "Capture"
 
-async def opendb():
-    global db
-    db = await aiosqlite.connect(core.config.locations.database)
-    await db.execute(
-        """CREATE TABLE IF NOT EXISTS requests(
+
+@contextlib.asynccontextmanager
+async def atomic(db: aiosqlite.Connection):
+    async with transaction:
+        try:
+            yield
+        except BaseException:
+            await db.rollback()
+            raise
+
+
+async def intern(
+    db: aiosqlite.Connection, cache: dict[str, dict[str, int]], rows: list[tuple]
+) -> list[tuple]:
+    for column, table in INTERNED.items():
+        ids = cache.setdefault(table, {})
+        if len(ids) > INTERN_CACHE_SIZE:
+            ids.clear()
+        for value in {row[column] for row in rows} - ids.keys() - {None}:
+            await db.execute(
+                f"INSERT INTO {table}(value) VALUES (?) ON CONFLICT DO NOTHING;",
+                (value,),
+            )
+            async with db.execute(
+                f"SELECT id FROM {table} WHERE value = ?;", (value,)
+            ) as cursor:
+                (ids[value],) = await cursor.fetchone()
+    return [
+        tuple(
+            cache[INTERNED[i]].get(v) if i in INTERNED else v
+            for i, v in enumerate(row[: len(COLUMNS)])
+        )
+        for row in rows
+    ]
+
+
+def redact(items: Iterable[tuple[str, str]]) -> str | None:
+    values = {k: REDACTED if k.lower() in redacted else v for k, v in items}
+    return json.dumps(values, separators=(",", ":")) if values else None
+
+
+async def compact(db: aiosqlite.Connection):
+    cache: dict[str, dict[str, int]] = {}
+    async with db.execute(
+        "SELECT received_ts_ns, elapsed_ns, method, url, client, headers,"
+        " status, ttfb_ns, bytes_sent FROM requests_v1 ORDER BY count;"
+    ) as cursor:
+        while batch := await cursor.fetchmany(1000):
+            rows = []
+            for received, elapsed, method, url, client, headers, *rest in batch:
+                url = urlsplit(url)
+                client = LEGACY_CLIENT.search(client or "")
+                agent = LEGACY_AGENT.search(headers or "")
+                rows.append(
+                    (
+                        received,
+                        elapsed,
+                        method,
+                        url.path,
+                        redact(parse_qsl(url.query)),
+                        agent and agent[1],
+                        client and client[1],
+                        None,
+                        None,
+                        *rest,
+                    )
+                )
+            await db.executemany(
+                "INSERT INTO requests(received_ts_ns, elapsed_ns, method, path,"
+                " query, agent, client, headers, cookies, status, ttfb_ns,"
+                " bytes_sent) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);",
+                await intern(db, cache, rows),
+            )
+
+
+MIGRATIONS: list[str | Callable[[aiosqlite.Connection], Awaitable[None]]] = [
+    """CREATE TABLE IF NOT EXISTS requests(
          count INTEGER PRIMARY KEY AUTOINCREMENT,
          received_ts_ns INTEGER,
          elapsed_ns INTEGER,
@@ -24,48 +149,575 @@ async def opendb():
          path_params TEXT,
          client TEXT,
          cookies TEXT
-    );"""
+    );""",
+    "ALTER TABLE requests ADD COLUMN status INTEGER;",
+    "ALTER TABLE requests ADD COLUMN ttfb_ns INTEGER;",
+    "ALTER TABLE requests ADD COLUMN bytes_sent INTEGER;",
+    "CREATE INDEX requests_received_client ON requests(received_ts_ns, client);",
+    "CREATE INDEX requests_received_url ON requests(received_ts_ns, url);",
+    """CREATE TABLE rollup(
+         bucket INTEGER,
+         route TEXT,
+         bin INTEGER,
+         count INTEGER,
+         errors INTEGER,
+         elapsed_ns INTEGER,
+         PRIMARY KEY(bucket, route, bin)
+    ) WITHOUT ROWID;""",
+    "CREATE TABLE methods(id INTEGER PRIMARY KEY, value TEXT UNIQUE NOT NULL);",
+    "CREATE TABLE paths(id INTEGER PRIMARY KEY, value TEXT UNIQUE NOT NULL);",
+    "CREATE TABLE agents(id INTEGER PRIMARY KEY, value TEXT UNIQUE NOT NULL);",
+    "ALTER TABLE requests RENAME TO requests_v1;",
+    """CREATE TABLE requests(
+         count INTEGER PRIMARY KEY AUTOINCREMENT,
+         received_ts_ns INTEGER,
+         elapsed_ns INTEGER,
+         method INTEGER REFERENCES methods(id),
+         path INTEGER REFERENCES paths(id),
+         query TEXT,
+         agent INTEGER REFERENCES agents(id),
+         client TEXT,
+         headers TEXT,
+         cookies TEXT,
+         status INTEGER,
+         ttfb_ns INTEGER,
+         bytes_sent INTEGER
+    );""",
+    compact,
+    "DROP TABLE requests_v1;",
+    "CREATE INDEX requests_received_client ON requests(received_ts_ns, client);",
+    "CREATE INDEX requests_received_path ON requests(received_ts_ns, path);",
+    "CREATE INDEX requests_received_agent ON requests(received_ts_ns, agent);",
+    "ALTER TABLE requests ADD COLUMN weight REAL NOT NULL DEFAULT 1;",
+    "DROP INDEX requests_received_client;",
+    "CREATE INDEX requests_received_client ON requests(received_ts_ns, client, weight);",
+    "DROP INDEX requests_received_path;",
+    "CREATE INDEX requests_received_path ON requests(received_ts_ns, path, weight);",
+    "DROP INDEX requests_received_agent;",
+    "CREATE INDEX requests_received_agent ON requests(received_ts_ns, agent, weight);",
+]
+ROLLUP = (
+    "INSERT INTO rollup(bucket, route, bin, count, errors, elapsed_ns)"
+    " VALUES (?, ?, ?, ?, ?, ?)"
+    " ON CONFLICT(bucket, route, bin) DO UPDATE SET"
+    " count = count + excluded.count,"
+    " errors = errors + excluded.errors,"
+    " elapsed_ns = elapsed_ns + excluded.elapsed_ns;"
+)
+
+
+def latency_bin(elapsed_ns: int) -> int:
+    return math.floor(math.log2(max(elapsed_ns, 1)) * BINS_PER_OCTAVE)
+
+
+def bin_latency(bin: int) -> float:
+    return 2 ** ((bin + 0.5) / BINS_PER_OCTAVE)
+
+
+def rollup(batch: list[tuple]) -> list[tuple]:
+    counts: defaultdict[tuple, float] = defaultdict(float)
+    errors: defaultdict[tuple, float] = defaultdict(float)
+    elapsed: defaultdict[tuple, float] = defaultdict(float)
+    for received, elapsed_ns, *_, status, _, _, weight, route in batch:
+        key = (received // BUCKET_NS, route, latency_bin(elapsed_ns))
+        counts[key] += weight
+        errors[key] += weight * (status >= 500)
+        elapsed[key] += weight * elapsed_ns
+    return [(*key, n, errors[key], elapsed[key]) for key, n in counts.items()]
+
+
+class BatchWriter:
+    def __init__(
+        self,
+        db: aiosqlite.Connection,
+        maxsize: int,
+        batch_size: int,
+        interval: float,
+        overflow: Literal["drop-oldest", "block"],
+    ):
+        self.db = db
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.interval = interval
+        self.overflow = overflow
+        self.rows: deque[tuple] = deque()
+        self.full = asyncio.Event()
+        self.space = asyncio.Event()
+        self.closing = False
+        self.dropped = 0
+        self.interned: dict[str, dict[str, int]] = {}
+        self.task = asyncio.create_task(self.run())
+
+    async def put(self, row: tuple):
+        while len(self.rows) >= self.maxsize:
+            if self.overflow == "drop-oldest":
+                self.rows.popleft()
+                self.dropped += 1
+            else:
+                self.full.set()
+                self.space.clear()
+                await self.space.wait()
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.full.set()
+
+    async def run(self):
+        while not self.closing:
+            with contextlib.suppress(TimeoutError):
+                async with asyncio.timeout(self.interval):
+                    await self.full.wait()
+            await self.flush()
+
+    async def flush(self):
+        while self.rows:
+            n = min(self.batch_size, len(self.rows))
+            batch = [self.rows.popleft() for _ in range(n)]
+            self.space.set()
+            await self.write(batch)
+        self.full.clear()
+
+    async def write(self, batch: list[tuple]):
+        start = time.perf_counter()
+        try:
+            async with atomic(self.db):
+                rows = await intern(self.db, self.interned, batch)
+                await self.db.executemany(INSERT, rows)
+                await self.db.executemany(ROLLUP, rollup(batch))
+                await self.db.commit()
+        except sqlite3.Error:
+            self.interned.clear()
+            log.exception(f"Failed to write {len(batch)} logged requests.")
+        flush_time.observe(time.perf_counter() - start)
+
+    async def close(self):
+        self.closing = True
+        self.full.set()
+        await self.task
+        await self.flush()
+        if self.dropped:
+            log.warning(f"Dropped {self.dropped} logged requests on overflow.")
+
+
+class SegmentWriter:
+    def __init__(self, directory: Path, max_bytes: int, interval: float):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.dropped = 0
+        self.file: TextIO | None = None
+        self.path: Path | None = None
+        self.size = 0
+        self.opening = asyncio.Lock()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.task = asyncio.create_task(self.run())
+
+    async def put(self, row: tuple):
+        if self.file is None:
+            async with self.opening:
+                if self.file is None:
+                    path = self.directory / f"{time.time_ns()}-{os.getpid()}.open"
+                    self.file = await asyncio.to_thread(
+                        path.open, "a", encoding="utf-8"
+                    )
+                    self.path, self.size = path, 0
+        line = json.dumps(row, separators=(",", ":")) + "\n"
+        self.file.write(line)
+        self.size += len(line)
+        if self.size >= self.max_bytes:
+            await self.rotate()
+
+    async def rotate(self):
+        if self.file is None or self.path is None:
+            return
+        file, path = self.file, self.path
+        self.file = self.path = None
+        await asyncio.to_thread(seal, file, path)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.rotate()
+
+    async def flush(self):
+        await self.rotate()
+
+    async def close(self):
+        self.task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self.task
+        await self.rotate()
+
+
+def seal(file: TextIO, path: Path):
+    file.close()
+    path.rename(path.with_suffix(".log"))
+
+
+def alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def recover(directory: Path):
+    for path in [*directory.glob("*.open"), *directory.glob("*.load")]:
+        base, *claim, _ = path.name.split(".")
+        owner = int(claim[0] if claim else base.partition("-")[2])
+        if not alive(owner):
+            path.rename(directory / f"{base}.log")
+
+
+def segment(path: Path) -> Iterator[tuple]:
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            with contextlib.suppress(json.JSONDecodeError):
+                row = tuple(json.loads(line))
+                row += (1.0,) * (len(COLUMNS) - len(row))
+                yield row if len(row) > len(COLUMNS) else row + (UNMATCHED,)
+
+
+async def load(
+    db: aiosqlite.Connection,
+    directory: Path,
+    cache: dict[str, dict[str, int]],
+    batch_size: int,
+) -> int:
+    loaded = 0
+    recover(directory)
+    for path in sorted(directory.glob("*.log")):
+        claimed = path.with_suffix(f".{os.getpid()}.load")
+        try:
+            path.rename(claimed)
+        except FileNotFoundError:
+            continue
+        start = time.perf_counter()
+        count = 0
+        try:
+            async with atomic(db):
+                await db.execute("BEGIN")
+                rows = segment(claimed)
+                while batch := await asyncio.to_thread(
+                    list, itertools.islice(rows, batch_size)
+                ):
+                    await db.executemany(INSERT, await intern(db, cache, batch))
+                    await db.executemany(ROLLUP, rollup(batch))
+                    count += len(batch)
+                claimed.unlink()
+                await db.commit()
+        except (sqlite3.Error, OSError):
+            cache.clear()
+            with contextlib.suppress(FileNotFoundError):
+                claimed.rename(path)
+            raise
+        loaded += count
+        flush_time.observe(time.perf_counter() - start)
+    return loaded
+
+
+async def compactor(db: aiosqlite.Connection, directory: Path, stop: asyncio.Event):
+    settings = core.config.requestlog
+    cache: dict[str, dict[str, int]] = {}
+    while True:
+        final = stop.is_set()
+        try:
+            await load(db, directory, cache, settings.batch_size)
+        except sqlite3.Error:
+            log.exception("Failed to load request log segments.")
+        if final:
+            return
+        with contextlib.suppress(TimeoutError):
+            async with asyncio.timeout(settings.segment_interval.total_seconds()):
+                await stop.wait()
+
+
+COLUMNS = [
+    "received_ts_ns",
+    "elapsed_ns",
+    "method",
+    "path",
+    "query",
+    "agent",
+    "client",
+    "headers",
+    "cookies",
+    "status",
+    "ttfb_ns",
+    "bytes_sent",
+    "weight",
+]
+EXPORT = (
+    "SELECT received_ts_ns, elapsed_ns, m.value, p.value, query, a.value, client,"
+    " headers, cookies, status, ttfb_ns, bytes_sent, weight FROM requests"
+    " LEFT JOIN methods m ON m.id = method"
+    " LEFT JOIN paths p ON p.id = path"
+    " LEFT JOIN agents a ON a.id = agent"
+    " WHERE received_ts_ns >= ? ORDER BY count;"
+)
+
+
+def records(
+    database: Path, segments: Path | Literal[False], since: int = 0
+) -> Iterator[dict]:
+    with contextlib.closing(
+        sqlite3.connect(f"{database.resolve().as_uri()}?mode=ro", uri=True)
+    ) as conn:
+        for row in conn.execute(EXPORT, (since,)):
+            yield dict(zip(COLUMNS, row))
+    if segments:
+        for path in sorted(segments.glob("*-*.*")):
+            with contextlib.suppress(FileNotFoundError):
+                for row in segment(path):
+                    if row[0] >= since:
+                        yield dict(zip(COLUMNS, row))
+
+
+async def migrate(db: aiosqlite.Connection):
+    await db.execute("BEGIN IMMEDIATE;")
+    async with db.execute("PRAGMA user_version;") as cursor:
+        (version,) = await cursor.fetchone()
+    for target, statement in enumerate(MIGRATIONS[version:], start=version + 1):
+        if isinstance(statement, str):
+            await db.execute(statement)
+        else:
+            await statement(db)
+        await db.execute(f"PRAGMA user_version = {target};")
+    await db.commit()
+
+
+async def retain(
+    db: aiosqlite.Connection,
+    max_age: float | None,
+    max_rows: int | None,
+    batch_size: int,
+) -> int:
+    cutoffs = []
+    async with atomic(db):
+        if max_age is not None:
+            oldest = time.time_ns() - int(max_age * 1e9)
+            async with db.execute(
+                "SELECT MIN(count), (SELECT MAX(count) FROM requests) + 1"
+                " FROM requests WHERE received_ts_ns >= ?;",
+                (oldest,),
+            ) as cursor:
+                first, end = await cursor.fetchone()
+            cutoffs.append(first or end or 0)
+            await db.execute(
+                "DELETE FROM rollup WHERE bucket < ?;", (oldest // BUCKET_NS,)
+            )
+        if max_rows is not None:
+            async with db.execute("SELECT MAX(count) FROM requests;") as cursor:
+                (last,) = await cursor.fetchone()
+            cutoffs.append((last or 0) - max_rows + 1)
+        await db.commit()
+    if not cutoffs:
+        return 0
+    deleted, cutoff = 0, max(cutoffs)
+    while True:
+        async with atomic(db):
+            cursor = await db.execute(
+                "DELETE FROM requests WHERE count IN"
+                " (SELECT count FROM requests WHERE count < ? ORDER BY count LIMIT ?);",
+                (cutoff, batch_size),
+            )
+            await db.commit()
+        deleted += cursor.rowcount
+        if cursor.rowcount < batch_size:
+            break
+        await asyncio.sleep(0)
+    async with atomic(db), db.execute("PRAGMA incremental_vacuum;") as cursor:
+        await cursor.fetchall()
+    return deleted
+
+
+async def retention(db: aiosqlite.Connection):
+    settings = core.config.requestlog
+    while True:
+        try:
+            deleted = await retain(
+                db,
+                settings.max_age and settings.max_age.total_seconds() or None,
+                settings.max_rows or None,
+                settings.delete_batch,
+            )
+            if deleted:
+                log.info(f"Deleted {deleted} logged requests past retention.")
+        except sqlite3.Error:
+            log.exception("Failed to enforce request log retention.")
+        await asyncio.sleep(settings.retention_interval.total_seconds())
+
+
+async def autovacuum(db: aiosqlite.Connection):
+    async with db.execute("PRAGMA auto_vacuum;") as cursor:
+        (mode,) = await cursor.fetchone()
+    if mode != 2:
+        await db.execute("PRAGMA auto_vacuum = INCREMENTAL;")
+        with contextlib.suppress(sqlite3.OperationalError):
+            await db.execute("VACUUM;")
+
+
+async def opendb():
+    global db, reader, writer, retention_task, allowed_headers, redacted, capture
+    global compactor_task, compactor_stop, transaction
+    settings = core.config.requestlog
+    allowed_headers = frozenset(h.lower() for h in settings.headers)
+    redacted = frozenset(k.lower() for k in settings.redact)
+    capture = Capture(
+        [(rule.prefix, rule.sample) for rule in settings.capture],
+        settings.always_status,
+        int(settings.always_slow.total_seconds() * 1e9),
     )
+    database = core.config.locations.database
+    db = await aiosqlite.connect(database)
+    transaction = asyncio.Lock()
+    await db.execute("PRAGMA journal_mode = WAL;")
+    await autovacuum(db)
+    await migrate(db)
+    reader = await aiosqlite.connect(f"{database.resolve().as_uri()}?mode=ro", uri=True)
+    if segments := core.config.locations.segments:
+        writer = SegmentWriter(
+            segments,
+            settings.segment_bytes,
+            settings.segment_interval.total_seconds(),
+        )
+        compactor_stop = asyncio.Event()
+        compactor_task = asyncio.create_task(compactor(db, segments, compactor_stop))
+    else:
+        writer = BatchWriter(
+            db,
+            settings.queue_size,
+            settings.batch_size,
+            settings.flush_interval.total_seconds(),
+            settings.overflow,
+        )
+    retention_task = asyncio.create_task(retention(db))
 
 
 async def closedb():
-    global db
-    await db.close()
-    del db
-
-
-async def _insert(request, received, elapsed):
-    await db.execute(
-        "INSERT INTO requests("
-        "received_ts_ns,"
-        "elapsed_ns,"
-        "method,"
-        "url,"
-        "headers,"
-        "query_params,"
-        "path_params,"
-        "client,"
-        "cookies"
-        ") VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);",
-        (
-            received,
-            elapsed,
-            str(request.method),
-            str(request.url),
-            str(request.headers),
-            str(request.query_params),
-            str(request.path_params),
-            str(request.client),
-            str(request.cookies),
-        ),
+    global db, reader, writer, retention_task, compactor_task
+    retention_task.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await retention_task
+    try:
+        await writer.close()
+        if compactor_task is not None:
+            compactor_stop.set()
+            await compactor_task
+    finally:
+        compactor_task = None
+        await reader.close()
+        await db.close()
+        del db, reader, writer, retention_task
+
+
+def queued() -> int:
+    try:
+        return len(writer.rows)
+    except (NameError, AttributeError):
+        return 0
+
+
+instruments.Gauge(
+    "aidan_requestlog_queue_depth", "Logged requests waiting to be written.", queued
+)
+
+
+class Capture:
+    def __init__(self, rules: list[tuple[str, float]], status: int, slow: int):
+        self.rules = sorted(rules, key=lambda r: -len(r[0]))
+        self.status = status
+        self.slow = slow
+
+    def weight(self, path: str, status: int, elapsed: int) -> float | None:
+        if status >= self.status or elapsed >= self.slow:
+            return 1.0
+        rate = next(
+            (rate for prefix, rate in self.rules if path.startswith(prefix)), 1.0
+        )
+        if rate >= 1:
+            return 1.0
+        if random.random() < rate:
+            return 1 / rate
+        return None
+
+
+def _row(
+    request: Request,
+    received: int,
+    elapsed: int,
+    status: int,
+    ttfb: int | None,
+    sent: int,
+    weight: float = 1.0,
+    route: str = UNMATCHED,
+) -> tuple:
+    headers = request.headers
+    return (
+        received,
+        elapsed,
+        request.method,
+        request.url.path,
+        redact(request.query_params.multi_items()),
+        headers.get("user-agent"),
+        request.client and request.client.host,
+        redact((k, v) for k, v in headers.items() if k in allowed_headers),
+        redact(request.cookies.items()),
+        status,
+        ttfb,
+        sent,
+        weight,
+        route,
     )
-    await db.commit()
 
 
-class LogRequests(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
+def template(scope: Scope) -> str:
+    route = scope.get("route")
+    return route.path if route is not None else UNMATCHED
+
+
+class LogRequests:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
         received = time.time_ns()
-        response = await call_next(request)
-        elapsed = time.time_ns() - received
-        await _insert(request, received, elapsed)
-        return response
+        start = time.perf_counter_ns()
+        status = 500
+        ttfb = None
+        sent = 0
+
+        async def observe(message: Message):
+            nonlocal status, ttfb, sent
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                ttfb = time.perf_counter_ns() - start
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            elif message["type"] == "http.response.zerocopy":
+                sent += message["count"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, observe)
+        finally:
+            elapsed = time.perf_counter_ns() - start
+            weight = capture.weight(scope["path"], status, elapsed)
+            if weight is not None:
+                await writer.put(
+                    _row(
+                        Request(scope),
+                        received,
+                        elapsed,
+                        status,
+                        ttfb,
+                        sent,
+                        weight,
+                        template(scope),
+                    )
+                )
@@ -1,70 +1,588 @@
+import asyncio
+import contextlib
+import json
+import logging
 import mimetypes
+import mmap
+import os
+import posixpath
+import re
+import secrets
+import struct
 import sys
+import threading
+import time
 import zipfile
-from typing import Protocol
+from collections import OrderedDict
+from collections.abc import Callable, Iterator
+from dataclasses import dataclass, field, replace
+from email.utils import formatdate, parsedate_to_datetime
+from functools import cached_property
+from pathlib import Path
+from typing import IO, Protocol
 
-from fastapi import APIRouter, HTTPException, Response
+from fastapi import APIRouter, HTTPException, Request, Response
 from fastapi.responses import FileResponse, StreamingResponse
+from starlette.types import Receive, Scope, Send
 
-from . import core
+from . import core, instruments
 from .auth import Auth
 
+log = logging.getLogger(__name__)
+
 
 class FileNotFound(HTTPException):
     def __init__(self):
         super().__init__(status_code=404, detail="Not Found.")
 
 
+ENCODINGS = {"br": ".br", "gzip": ".gz"}
+PREFIXES = ("public/", "protected/")
+CHUNK_SIZE = 64 * 1024
+MAX_RANGES = 16
+MANIFEST = "manifest.json"
+HASHED = re.compile(r"/assets/.+-[A-Za-z0-9_-]{8}\.\w+$")
+CACHE_CONTROL = {
+    "immutable": "max-age=31536000, immutable",
+    "short": "max-age=300",
+    "no-cache": "no-cache",
+}
+
+
+@dataclass(frozen=True)
+class Asset:
+    name: str
+    size: int
+    mtime: float
+    crc: int | None
+    media_type: str | None
+    encoding: str | None = None
+    variants: dict[str, "Asset"] = field(default_factory=dict)
+    stat: os.stat_result | None = None
+    offset: int | None = None
+    digest: str | None = None
+    cache_control: str | None = None
+    preload: tuple[str, ...] = ()
+
+    @cached_property
+    def etag(self) -> str:
+        if self.digest is not None:
+            return f'"{self.digest}"'
+        if self.crc is not None:
+            return f'"{self.crc:08x}-{self.size:x}"'
+        return f'"{self.size:x}-{int(self.mtime * 1_000_000):x}"'
+
+    @cached_property
+    def last_modified(self) -> str:
+        return formatdate(self.mtime, usegmt=True)
+
+
+def classify(name: str) -> str:
+    if name.endswith(".html") or name.partition("/")[2].startswith("login/"):
+        return "no-cache"
+    if HASHED.search(name):
+        return "immutable"
+    return "short"
+
+
+def cache_control(name: str, cache: str) -> str:
+    scope = "private" if name.startswith("protected/") else "public"
+    return f"{scope}, {CACHE_CONTROL[cache]}"
+
+
+def index(
+    files: dict[str, Asset], manifest: dict[str, dict] | None = None
+) -> dict[str, Asset]:
+    manifest = manifest or {}
+    routes = {}
+    for name, asset in files.items():
+        if any(
+            name.endswith(s) and name.removesuffix(s) in files
+            for s in ENCODINGS.values()
+        ):
+            continue
+        entry = manifest.get(name, {})
+        asset = replace(
+            asset,
+            media_type=entry.get("type", asset.media_type),
+            digest=entry.get("hash"),
+            cache_control=cache_control(name, entry.get("cache") or classify(name)),
+            preload=tuple(entry.get("preload", ())),
+        )
+        asset = replace(
+            asset,
+            variants={
+                e: replace(
+                    v,
+                    media_type=asset.media_type,
+                    encoding=e,
+                    cache_control=asset.cache_control,
+                    preload=asset.preload,
+                )
+                for e, s in ENCODINGS.items()
+                if (v := files.get(name + s)) is not None
+            },
+        )
+        routes[name] = asset
+        if posixpath.basename(name) == "index.html":
+            routes[posixpath.dirname(name)] = asset
+    return routes
+
+
+def lookup(routes: dict[str, Asset], prefix: str, path: str) -> Asset:
+    try:
+        return routes[posixpath.join(prefix, path.strip("/")).rstrip("/")]
+    except KeyError:
+        raise FileNotFound()
+
+
+def accepted_encodings(request: Request) -> list[str]:
+    accepted = set()
+    for item in request.headers.get("accept-encoding", "").split(","):
+        coding, _, params = item.partition(";")
+        quality = params.strip().removeprefix("q=")
+        try:
+            if quality and float(quality) == 0:
+                continue
+        except ValueError:
+            continue
+        accepted.add(coding.strip().lower())
+    return [e for e in ENCODINGS if e in accepted or "*" in accepted]
+
+
+def negotiate(request: Request, asset: Asset) -> tuple[Asset, dict[str, str]]:
+    if not asset.variants:
+        return asset, {}
+    headers = {"Vary": "Accept-Encoding"}
+    for encoding in accepted_encodings(request):
+        if encoding in asset.variants:
+            headers["Content-Encoding"] = encoding
+            return asset.variants[encoding], headers
+    return asset, headers
+
+
+def not_modified(request: Request, asset: Asset) -> bool:
+    if (if_none_match := request.headers.get("if-none-match")) is not None:
+        tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+        return asset.etag in tags or "*" in tags
+    if (if_modified_since := request.headers.get("if-modified-since")) is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(asset.mtime) <= since
+    return False
+
+
+def byteranges(request: Request, asset: Asset) -> list[tuple[int, int]] | None:
+    header = request.headers.get("range")
+    if header is None or not header.startswith("bytes="):
+        return None
+    if_range = request.headers.get("if-range")
+    if if_range is not None and if_range not in (asset.etag, asset.last_modified):
+        return None
+    spans = []
+    specs = header.removeprefix("bytes=").split(",")
+    if len(specs) > MAX_RANGES:
+        return None
+    for spec in specs:
+        first, sep, last = spec.strip().partition("-")
+        try:
+            if not sep:
+                return None
+            elif not first:
+                start, end = max(asset.size - int(last), 0), asset.size
+            elif last and int(last) < int(first):
+                return None
+            else:
+                start = int(first)
+                end = min(int(last) + 1, asset.size) if last else asset.size
+        except ValueError:
+            return None
+        if start < asset.size:
+            spans.append((start, end))
+    return spans
+
+
+def readfile(f: IO[bytes], start: int, end: int) -> Iterator[bytes]:
+    f.seek(start)
+    remaining = end - start
+    while remaining > 0 and (chunk := f.read(min(CHUNK_SIZE, remaining))):
+        remaining -= len(chunk)
+        yield chunk
+
+
+def conditional(
+    request: Request, asset: Asset, headers: dict[str, str]
+) -> Response | None:
+    headers |= {
+        "ETag": asset.etag,
+        "Last-Modified": asset.last_modified,
+        "Accept-Ranges": "bytes",
+    }
+    if asset.cache_control is not None:
+        headers["Cache-Control"] = asset.cache_control
+    if asset.preload:
+        headers["Link"] = ", ".join(asset.preload)
+    if not_modified(request, asset):
+        return Response(status_code=304, headers=headers)
+    return None
+
+
+def ranged(
+    request: Request,
+    asset: Asset,
+    headers: dict[str, str],
+    read: Callable[[Asset, int, int], Iterator[bytes]],
+) -> Response | None:
+    spans = byteranges(request, asset)
+    if spans is None:
+        return None
+    if not spans:
+        return Response(
+            status_code=416, headers={"Content-Range": f"bytes */{asset.size}"}
+        )
+    if len(spans) == 1:
+        start, end = spans[0]
+        headers |= {
+            "Content-Range": f"bytes {start}-{end - 1}/{asset.size}",
+            "Content-Length": str(end - start),
+        }
+        return StreamingResponse(
+            read(asset, start, end),
+            status_code=206,
+            media_type=asset.media_type,
+            headers=headers,
+        )
+
+    boundary = secrets.token_hex(16)
+
+    def multipart():
+        for start, end in spans:
+            yield (
+                f"--{boundary}\r\n"
+                f"Content-Type: {asset.media_type or 'application/octet-stream'}\r\n"
+                f"Content-Range: bytes {start}-{end - 1}/{asset.size}\r\n\r\n"
+            ).encode()
+            yield from read(asset, start, end)
+            yield b"\r\n"
+        yield f"--{boundary}--\r\n".encode()
+
+    headers.pop("Content-Length", None)
+    return StreamingResponse(
+        multipart(),
+        status_code=206,
+        media_type=f"multipart/byteranges; boundary={boundary}",
+        headers=headers,
+    )
+
+
+class EarlyHints(Response):
+    def __init__(self, response: Response, links: tuple[str, ...]):
+        super().__init__(
+            status_code=response.status_code,
+            media_type=response.media_type,
+            background=response.background,
+        )
+        self.response = response
+        self.links = links
+        self.body = getattr(response, "body", b"")
+        self.raw_headers = response.raw_headers
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if "http.response.early_hint" in scope.get("extensions", {}):
+            await send(
+                {
+                    "type": "http.response.early_hint",
+                    "links": [link.encode() for link in self.links],
+                }
+            )
+        self.response.background = self.background
+        await self.response(scope, receive, send)
+
+
+def hinted(asset: Asset, response: Response) -> Response:
+    if not asset.preload:
+        return response
+    return EarlyHints(response, asset.preload)
+
+
 class FSLoader:
-    def response(self, prefix: str, path: str):
-        if path.startswith("/"):
-            path = path[1:]
-        _path = core.config.locations.static / prefix / path
-
-        if _path.is_dir():
-            _path /= "index.html"
-        if not _path.is_file():
+    def __init__(self, root: Path | None = None):
+        self.root = root or core.config.locations.static
+        self.signature, self.routes = self.scan()
+
+    def scan(self) -> tuple[tuple, dict[str, Asset]]:
+        signature = []
+        files = {}
+        for directory, _, filenames in os.walk(self.root):
+            signature.append((directory, os.stat(directory).st_mtime_ns))
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                stat = os.stat(path)
+                signature.append((path, stat.st_mtime_ns, stat.st_size))
+                name = Path(path).relative_to(self.root).as_posix()
+                files[name] = Asset(
+                    name,
+                    stat.st_size,
+                    stat.st_mtime,
+                    None,
+                    mimetypes.guess_type(name)[0],
+                    stat=stat,
+                )
+        return tuple(signature), index(files, self.manifest())
+
+    def manifest(self) -> dict[str, dict]:
+        try:
+            return json.loads((self.root / MANIFEST).read_bytes())
+        except FileNotFoundError:
+            return {}
+
+    def changed(self) -> bool:
+        signature = []
+        for directory, _, filenames in os.walk(self.root):
+            signature.append((directory, os.stat(directory).st_mtime_ns))
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                stat = os.stat(path)
+                signature.append((path, stat.st_mtime_ns, stat.st_size))
+        return tuple(signature) != self.signature
+
+    def current(self, asset: Asset) -> Asset:
+        try:
+            stat = os.stat(self.root / asset.name)
+        except FileNotFoundError:
             raise FileNotFound()
-        return FileResponse(_path)
+        if asset.stat is not None and (stat.st_mtime_ns, stat.st_size) == (
+            asset.stat.st_mtime_ns,
+            asset.stat.st_size,
+        ):
+            return asset
+        return replace(
+            asset, size=stat.st_size, mtime=stat.st_mtime, stat=stat, digest=None
+        )
 
+    async def watch(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if await asyncio.to_thread(self.changed):
+                    self.signature, self.routes = await asyncio.to_thread(self.scan)
+                    log.info(f"Reindexed {len(self.routes)} static routes.")
+            except OSError:
+                log.exception("Failed to reindex static files.")
 
-class PYZLoader:
+    def read(self, asset: Asset, start: int, end: int) -> Iterator[bytes]:
+        with open(self.root / asset.name, "rb") as f:
+            yield from readfile(f, start, end)
+
+    def response(self, request: Request, prefix: str, path: str):
+        asset, headers = negotiate(request, lookup(self.routes, prefix, path))
+        asset = self.current(asset)
+        response = conditional(request, asset, headers) or ranged(
+            request, asset, headers, self.read
+        )
+        if response is not None:
+            return response
+        return hinted(
+            asset,
+            FileResponse(
+                self.root / asset.name,
+                media_type=asset.media_type,
+                headers=headers,
+                stat_result=asset.stat,
+            ),
+        )
+
+
+class AssetCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries: OrderedDict[str, bytes] = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def lookup(self, key: str) -> bytes | None:
+        with self.lock:
+            if (data := self.entries.get(key)) is not None:
+                self.hits += 1
+                self.entries.move_to_end(key)
+            return data
+
+    def get(self, key: str, load: Callable[[], bytes]) -> bytes:
+        if (data := self.lookup(key)) is not None:
+            return data
+        with self.lock:
+            self.misses += 1
+        data = load()
+        self.put(key, data)
+        return data
+
+    def put(self, key: str, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.size -= len(self.entries.pop(key))
+            self.entries[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+            "bytes": self.size,
+        }
+
+
+class CachedResponse(Response):
     def __init__(
         self,
+        cache: AssetCache,
+        asset: Asset,
+        load: Callable[[], bytes],
+        headers: dict[str, str],
     ):
-        self.pyz = zipfile.ZipFile(sys.argv[0])
+        super().__init__(media_type=asset.media_type, headers=headers)
+        self.headers["content-length"] = str(asset.size)
+        self.cache = cache
+        self.name = asset.name
+        self.load = load
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        self.body = await asyncio.to_thread(self.cache.get, self.name, self.load)
+        await super().__call__(scope, receive, send)
 
-    def streamfile(self, zinfo):
-        with self.pyz.open(zinfo) as f:
-            yield from f
 
-    def response(self, prefix: str, path: str):
-        if path.startswith("/"):
-            _path = path[1:]
-        _path = prefix + "/" + path
+class MappedResponse(Response):
+    def __init__(
+        self,
+        view: memoryview,
+        file: IO[bytes],
+        offset: int,
+        media_type: str | None,
+        headers: dict[str, str],
+    ):
+        self.file = file
+        self.offset = offset
+        super().__init__(view, media_type=media_type, headers=headers)
 
+    def render(self, content: memoryview) -> memoryview:
+        return content
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if "http.response.zerocopy" not in scope.get("extensions", {}):
+            return await super().__call__(scope, receive, send)
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            }
+        )
+        await send(
+            {
+                "type": "http.response.zerocopy",
+                "file": self.file,
+                "offset": self.offset,
+                "count": len(self.body),
+            }
+        )
+
+
+class PYZLoader:
+    def __init__(self, path: Path = Path(sys.argv[0])):
+        self.pyz = zipfile.ZipFile(path)
+        self.file = self.pyz.fp
+        self.mapping = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.cache = AssetCache(core.config.staticfiles.cache_bytes)
+        self.routes = index(
+            {
+                zinfo.filename: Asset(
+                    zinfo.filename,
+                    zinfo.file_size,
+                    time.mktime(zinfo.date_time + (0, 0, -1)),
+                    zinfo.CRC,
+                    mimetypes.guess_type(zinfo.filename)[0],
+                    offset=self.offset(zinfo),
+                )
+                for zinfo in self.pyz.infolist()
+                if zinfo.filename.startswith(PREFIXES) and not zinfo.is_dir()
+            },
+            self.manifest(),
+        )
+
+    def close(self):
+        self.pyz.close()
+
+    def manifest(self) -> dict[str, dict]:
         try:
-            zinfo = self.pyz.getinfo(_path)
+            return json.loads(self.pyz.read(MANIFEST))
         except KeyError:
-            try:
-                _path += "/index.html"
-                zinfo = self.pyz.getinfo(_path)
-            except KeyError:
-                raise FileNotFound()
+            return {}
 
-        if zinfo.is_dir():
-            try:
-                zinfo = self.pyz.getinfo(_path + "index.html")
-            except KeyError:
-                raise FileNotFound()
+    def offset(self, zinfo: zipfile.ZipInfo) -> int | None:
+        if zinfo.compress_type != zipfile.ZIP_STORED or zinfo.flag_bits & 0x1:
+            return None
+        header = self.mapping[zinfo.header_offset : zinfo.header_offset + 30]
+        if header[:4] != b"PK\x03\x04":
+            return None
+        name_length, extra_length = struct.unpack("<HH", header[26:30])
+        return zinfo.header_offset + 30 + name_length + extra_length
 
-        return StreamingResponse(
-            self.streamfile(zinfo), media_type=mimetypes.guess_type(zinfo.filename)[0]
+    def streamfile(self, name: str):
+        with self.pyz.open(name) as f:
+            yield from f
+
+    def read(self, asset: Asset, start: int, end: int) -> Iterator[bytes]:
+        if asset.offset is not None:
+            yield self.mapping[asset.offset + start : asset.offset + end]
+        elif asset.size <= self.cache.max_bytes:
+            yield self.cache.get(asset.name, lambda: self.pyz.read(asset.name))[
+                start:end
+            ]
+        else:
+            with self.pyz.open(asset.name) as f:
+                yield from readfile(f, start, end)
+
+    def response(self, request: Request, prefix: str, path: str):
+        asset, headers = negotiate(request, lookup(self.routes, prefix, path))
+        response = conditional(request, asset, headers) or ranged(
+            request, asset, headers, self.read
         )
+        if response is not None:
+            return response
+        if asset.offset is not None:
+            view = memoryview(self.mapping)[asset.offset : asset.offset + asset.size]
+            response = MappedResponse(
+                view, self.file, asset.offset, asset.media_type, headers
+            )
+        elif asset.size > self.cache.max_bytes:
+            response = StreamingResponse(
+                self.streamfile(asset.name),
+                media_type=asset.media_type,
+                headers=headers,
+            )
+        elif (body := self.cache.lookup(asset.name)) is not None:
+            response = Response(body, media_type=asset.media_type, headers=headers)
+        else:
+            response = CachedResponse(
+                self.cache, asset, lambda: self.pyz.read(asset.name), headers
+            )
+        return hinted(asset, response)
 
 
 class Loader(Protocol):
-    def response(self, prefix: str, path: str) -> Response:
+    def response(self, request: Request, prefix: str, path: str) -> Response:
         ...
 
 
@@ -83,19 +601,66 @@ def loader():
         return _loader
 
 
+def cache_stats() -> dict[str, int]:
+    try:
+        cache = getattr(_loader, "cache", None)
+    except NameError:
+        cache = None
+    return cache.stats() if cache is not None else {"hits": 0, "misses": 0}
+
+
+instruments.Counter(
+    "aidan_static_cache_hits_total",
+    "Static asset cache hits.",
+    lambda: cache_stats()["hits"],
+)
+instruments.Counter(
+    "aidan_static_cache_misses_total",
+    "Static asset cache misses.",
+    lambda: cache_stats()["misses"],
+)
+
+
+watcher: asyncio.Task | None = None
+
+
+async def openloader():
+    global watcher
+    instance = await asyncio.to_thread(loader)
+    if isinstance(instance, FSLoader):
+        interval = core.config.staticfiles.poll_interval.total_seconds()
+        watcher = asyncio.create_task(instance.watch(interval))
+
+
+async def closeloader():
+    global watcher, _loader
+    if watcher is not None:
+        watcher.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await watcher
+        watcher = None
+    try:
+        instance = _loader
+    except NameError:
+        return
+    if isinstance(instance, PYZLoader):
+        instance.close()
+        del _loader
+
+
 api: APIRouter = APIRouter()
 
 
 @api.get("/admin")
-async def base_admin(auth: Auth):
-    return await protected_file(auth, "")
+async def base_admin(auth: Auth, request: Request):
+    return await protected_file(auth, request, "")
 
 
 @api.get("/admin/{path:path}")
-async def protected_file(auth: Auth, path: str):
-    return loader().response("protected", path)
+async def protected_file(auth: Auth, request: Request, path: str):
+    return loader().response(request, "protected", path)
 
 
 @api.get("/{path:path}")
-async def public_file(path: str):
-    return loader().response("public", path)
+async def public_file(request: Request, path: str):
+    return loader().response(request, "public", path)
@@ -0,0 +1,136 @@
+import contextlib
+import logging
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from . import core
+
+log = logging.getLogger(__name__)
+LISTENER_FD = "AIDAN_SOFTWARE_LISTENER_FD"
+READY_FILE = "AIDAN_SOFTWARE_READY_FILE"
+READY_TIMEOUT = 120
+
+listener: socket.socket | None = None
+ready_file: Path | None = None
+upgrading = threading.Lock()
+
+
+def listen(
+    host: str, port: int, uds: Path | None = None, backlog: int = 2048
+) -> socket.socket:
+    global listener, ready_file
+    if (path := os.environ.pop(READY_FILE, None)) is not None:
+        ready_file = Path(path)
+    if (fd := os.environ.pop(LISTENER_FD, None)) is not None:
+        listener = socket.socket(fileno=int(fd))
+    elif uds is not None:
+        uds.unlink(missing_ok=True)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(str(uds))
+        uds.chmod(0o666)
+        listener.listen(backlog)
+    else:
+        listener = socket.create_server((host, port), backlog=backlog)
+    listener.set_inheritable(True)
+    return listener
+
+
+def supervise(fifo: Path, workers: int):
+    fifo.parent.mkdir(parents=True, exist_ok=True)
+    fifo.unlink(missing_ok=True)
+    os.mkfifo(fifo)
+
+    def wait():
+        started: set[str] = set()
+        while True:
+            with open(fifo) as f:
+                messages = f.read().split()
+            for message in messages:
+                match message.split(":"):
+                    case ["upgrade"]:
+                        handover()
+                    case ["ready", pid]:
+                        started.add(pid)
+                        if len(started) >= workers:
+                            report()
+
+    threading.Thread(target=wait, daemon=True).start()
+
+
+def notify(message: str, attempts: int = 1) -> bool:
+    for attempt in range(attempts):
+        try:
+            fd = os.open(
+                core.config.server.bus / "upgrade", os.O_WRONLY | os.O_NONBLOCK
+            )
+        except OSError:
+            if attempt + 1 < attempts:
+                time.sleep(0.05)
+            continue
+        with open(fd, "w") as f:
+            f.write(message + "\n")
+        return True
+    return False
+
+
+def report():
+    global ready_file
+    if ready_file is not None:
+        with contextlib.suppress(FileNotFoundError):
+            ready_file.write_text(str(os.getpid()))
+        ready_file = None
+
+
+def ready():
+    if core.config.server.workers > 1:
+        notify(f"ready:{os.getpid()}", attempts=20)
+    else:
+        report()
+
+
+def command() -> list[str]:
+    if core.config.zipapp:
+        return [sys.executable, *sys.argv]
+    return [sys.executable, "-m", "server", *sys.argv[1:]]
+
+
+def request():
+    if core.config.server.workers > 1:
+        if not notify("upgrade"):
+            log.warning("Upgrade already in progress.")
+    else:
+        threading.Thread(target=handover).start()
+
+
+def handover():
+    assert listener is not None
+    if not upgrading.acquire(blocking=False):
+        log.warning("Upgrade already in progress.")
+        return
+    with tempfile.TemporaryDirectory() as tmpdir:
+        ready_file = Path(tmpdir) / "ready"
+        process = subprocess.Popen(
+            command(),
+            env=os.environ
+            | {LISTENER_FD: str(listener.fileno()), READY_FILE: str(ready_file)},
+            pass_fds=[listener.fileno()],
+            start_new_session=True,
+        )
+        deadline = time.monotonic() + READY_TIMEOUT
+        while not ready_file.exists():
+            if process.poll() is not None or time.monotonic() > deadline:
+                log.error("Upgraded server failed to start. Keeping this one.")
+                if process.poll() is None:
+                    process.terminate()
+                upgrading.release()
+                return
+            time.sleep(0.1)
+    log.info(f"Upgraded server {process.pid} is ready. Draining this one...")
+    os.kill(os.getpid(), signal.SIGTERM)
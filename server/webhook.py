@@ -1,79 +1,157 @@
 import asyncio
-import contextlib
+import fcntl
 import hashlib
 import hmac
 import json
-import os
-import shutil
 import subprocess
-import sys
+import time
 from pathlib import Path
 from typing import Annotated
 
-import psutil
-from fastapi import APIRouter, BackgroundTasks, Header, HTTPException, Request
+from fastapi import APIRouter, Header, HTTPException, Request
 
-from . import core
+from . import core, upgrade
+from .auth import Auth
 
 api = APIRouter()
+REPOSITORY = "https://github.com/aidaco/www"
 
 
-async def cleanup():
-    tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
-    [t.cancel() for t in tasks]
-    try:
-        await asyncio.gather(*tasks)
-    except asyncio.CancelledError:
-        pass
-
-    pid = os.getpid()
-    parent = psutil.Process(pid)
-    for ch in parent.children(recursive=True):
-        for fd in ch.open_files() + ch.connections():
-            try:
-                os.fsync(fd.fd)
-                os.close(fd.fd)
-            except OSError:
-                pass
-
-
-def rebuild_pyz():
-    git_dir = Path.cwd() / "git.aidan.software"
-    subprocess.run(
-        f"git clone --branch main --single-branch https://github.com/aidaco/www {git_dir}",
-        shell=True,
-        capture_output=True,
-        check=True,
-    )
-    with contextlib.chdir(git_dir):
-        subprocess.run("./dev.py buildpyz", shell=True, capture_output=True, check=True)
-    (git_dir / "aidan.software.pyz").replace(Path.cwd() / "aidan.software.pyz")
-    shutil.rmtree(git_dir)
-    core.log.info("Successfully rebuilt. Restarting...")
-    os.execv(sys.executable, ["python", *sys.argv])
-
-
-def rebuild_static():
-    subprocess.run("git pull", shell=True, check=True, capture_output=True)
-    subprocess.run(
-        f"{Path.cwd()/'dev.py'} buildstatic",
-        shell=True,
-        check=True,
-        capture_output=True,
+async def sh(command: str, cwd: Path | None = None) -> bytes:
+    process = await asyncio.create_subprocess_shell(
+        command,
+        cwd=cwd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
     )
-    core.log.info("Successfully rebuilt. Restarting...")
-    args = (sys.executable, (sys.executable, "-m", "server", *sys.argv[1:]))
-    os.execv(*args)
+    output, _ = await process.communicate()
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command, output)
+    return output
 
 
-async def rebuild():
-    global rebuild_task
-    # await cleanup()
-    core.log.info("Push received. Starting rebuild...")
-    if core.config.zipapp:
-        rebuild_pyz()
-    else:
-        rebuild_static()
+class Rebuilder:
+    def __init__(
+        self, directory: Path, repo: Path, url: str, branch: str, zipapp: bool
+    ):
+        self.directory = directory
+        self.repo = repo
+        self.url = url
+        self.branch = branch
+        self.zipapp = zipapp
+        self.status = directory / "status.json"
+        self.queued = False
+        self.task: asyncio.Task | None = None
+
+    def request(self):
+        self.queued = True
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with await asyncio.to_thread(open, self.directory / "lock", "w") as lock:
+            await asyncio.to_thread(fcntl.flock, lock, fcntl.LOCK_EX)
+            while self.queued:
+                self.queued = False
+                await self.build()
+
+    def load(self) -> dict:
+        try:
+            return json.loads(self.status.read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {"built": {}, "build": None}
+
+    def save(self, state: dict):
+        self.status.write_text(json.dumps(state, indent=2))
+
+    async def hash(self, *paths: str) -> str:
+        trees = await sh(
+            f"git rev-parse {' '.join(f'HEAD:{p}' for p in paths)}", self.repo
+        )
+        return hashlib.sha256(trees).hexdigest()
+
+    def fail(self, build: dict, error: str):
+        build["state"] = "failed"
+        build["error"] = error
+        core.log.error(f"Rebuild failed: {error}")
+
+    async def build(self):
+        state = self.load()
+        build = state["build"] = {
+            "state": "building",
+            "started": time.time(),
+            "commit": None,
+            "stages": {},
+        }
+        self.save(state)
+        core.log.info("Push received. Starting rebuild...")
+        start = time.perf_counter()
+
+        async def stage(name: str, command: str, cwd: Path | None = None):
+            t = time.perf_counter()
+            await sh(command, cwd)
+            build["stages"][name] = time.perf_counter() - t
+            self.save(state)
+
+        try:
+            if not (self.repo / ".git").exists():
+                await stage(
+                    "clone",
+                    f"git clone --branch {self.branch} --single-branch {self.url} {self.repo}",
+                )
+            await stage("fetch", f"git fetch --quiet origin {self.branch}", self.repo)
+            await stage("merge", "git merge --quiet --ff-only FETCH_HEAD", self.repo)
+            build["commit"] = (
+                (await sh("git rev-parse HEAD", self.repo)).decode().strip()
+            )
+            hashes = {
+                "frontend": await self.hash("protected", "public"),
+                "python": await self.hash("server", "pyproject.toml", "poetry.lock"),
+            }
+            changed = {k for k, v in hashes.items() if state["built"].get(k) != v}
+            if "frontend" in changed:
+                await stage("frontend", "./dev.py buildstatic", self.repo)
+            if self.zipapp and changed:
+                await stage("pyz", "./dev.py buildpyz --no-static", self.repo)
+                (self.repo / "aidan.software.pyz").replace(
+                    Path.cwd() / "aidan.software.pyz"
+                )
+        except subprocess.CalledProcessError as e:
+            return self.fail(build, f"{e.cmd}\n{e.output.decode(errors='replace')}")
+        except OSError as e:
+            return self.fail(build, str(e))
+        finally:
+            build["duration"] = time.perf_counter() - start
+            self.save(state)
+        state["built"] = hashes
+        build["state"] = "built" if changed else "unchanged"
+        self.save(state)
+        if changed:
+            core.log.info(f"Rebuilt {', '.join(sorted(changed))}. Upgrading...")
+            upgrade.request()
+        else:
+            core.log.info("Nothing changed. Skipping upgrade.")
+
+
+_rebuilder: Rebuilder
+
+
+def rebuilder() -> Rebuilder:
+    global _rebuilder
+    try:
+        return _rebuilder
+    except NameError:
+        directory = core.config.locations.build.resolve()
+        settings = core.config.rebuild
+        _rebuilder = Rebuilder(
+            directory,
+            directory / "repo" if core.config.zipapp else Path.cwd(),
+            REPOSITORY,
+            (settings and settings.branch) or "main",
+            core.config.zipapp,
+        )
+        return _rebuilder
 
 
 def verify_signature(body: bytes, signature: str, secret: str) -> None:
@@ -113,9 +191,7 @@ async def receive_webhook(
     appname: str,
     x_github_event: Annotated[str, Header()],
     x_hub_signature_256: Annotated[str, Header()],
-    background: BackgroundTasks,
 ):
-    global rebuild_task
     match x_github_event:
         case "ping":
             return {"message": "pong"}
@@ -132,5 +208,11 @@ async def receive_webhook(
         body, core.config.rebuild.branch
     ):
         return {"message": "Not on default branch: no action will be taken."}
-    background.add_task(rebuild)
-    return {"message": "Push received, started upgrade."}
+    rebuilder().request()
+    return {"message": "Push received, queued rebuild."}
+
+
+@api.get("/webhook/{appname}/status")
+async def rebuild_status(auth: Auth, appname: str):
+    builder = rebuilder()
+    return builder.load() | {"queued": builder.queued}
@@ -1,58 +1,197 @@
+import asyncio
+import contextlib
 import logging
+import time
+from collections import deque
+from collections.abc import Callable
+from typing import Literal
 from uuid import uuid4
 
 from fastapi import HTTPException, WebSocket, WebSocketDisconnect
 
+from . import core
+
 log = logging.getLogger(__name__)
+closing: set[asyncio.Task] = set()
+
+
+def closed(task: asyncio.Task):
+    closing.discard(task)
+    if not task.cancelled() and (error := task.exception()) is not None:
+        log.error("Closing websocket failed", exc_info=error)
+
+
+def close(connection: "Connection", code: int):
+    task = asyncio.create_task(connection.close(code))
+    closing.add(task)
+    task.add_done_callback(closed)
+
+
+class Connection:
+    def __init__(
+        self,
+        websocket: WebSocket,
+        maxsize: int,
+        policy: Literal["drop", "coalesce", "disconnect"],
+        snapshot: Callable[[], list[str]],
+        closed: Callable[[], None],
+    ):
+        self.websocket = websocket
+        self.maxsize = maxsize
+        self.policy = policy
+        self.snapshot = snapshot
+        self.closed = closed
+        self.queue: deque[str] = deque()
+        self.ready = asyncio.Event()
+        self.dropped = 0
+        self.seen = time.monotonic()
+        self.task = asyncio.create_task(self.write())
+
+    def send(self, message: str):
+        if len(self.queue) >= self.maxsize:
+            match self.policy:
+                case "drop":
+                    self.dropped += 1
+                    return
+                case "coalesce":
+                    self.dropped += len(self.queue)
+                    self.queue.clear()
+                    self.queue.extend(self.snapshot())
+                case "disconnect":
+                    self.closed()
+                    close(self, 1008)
+                    return
+        else:
+            self.queue.append(message)
+        self.ready.set()
+
+    async def write(self):
+        try:
+            while True:
+                while not self.queue:
+                    self.ready.clear()
+                    await self.ready.wait()
+                await self.websocket.send_text(self.queue.popleft())
+        except (WebSocketDisconnect, RuntimeError, OSError):
+            self.closed()
+
+    async def close(self, code: int = 1000):
+        self.task.cancel()
+        try:
+            await self.websocket.close(code)
+        except (WebSocketDisconnect, RuntimeError, OSError):
+            pass
 
 
 class WSManager:
     def __init__(self) -> None:
-        self.connections: dict[str, WebSocket] = {}
+        self.connections: dict[str, Connection] = {}
         self.state: dict[str, tuple[bool, str]] = {}
+        self.heartbeat_task: asyncio.Task | None = None
+        self.prefix = ""
+
+    def start(self, interval: float, timeout: float):
+        self.heartbeat_task = asyncio.create_task(self.heartbeat(interval, timeout))
+
+    async def stop(self, code: int = 1001):
+        if self.heartbeat_task is not None:
+            self.heartbeat_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self.heartbeat_task
+            self.heartbeat_task = None
+        connections = list(self.connections.values())
+        for uid in list(self.connections):
+            self.disconnect(uid)
+        await asyncio.gather(*(c.close(code) for c in connections))
+        await asyncio.gather(*closing, return_exceptions=True)
+
+    async def heartbeat(self, interval: float, timeout: float):
+        while True:
+            await asyncio.sleep(interval)
+            deadline = time.monotonic() - interval - timeout
+            for uid, connection in list(self.connections.items()):
+                if connection.seen < deadline:
+                    log.info(f"Reaping unresponsive {uid}")
+                    self.disconnect(uid)
+                    close(connection, 1001)
+                else:
+                    connection.send("PING")
+
+    def seen(self, uid: str):
+        if (connection := self.connections.get(uid)) is not None:
+            connection.seen = time.monotonic()
 
     async def connect(self, websocket: WebSocket) -> str | None:
         await websocket.accept()
-        uid = str(uuid4())
+        uid = f"{self.prefix}{uuid4()}"
         try:
             await websocket.send_text("CONNECT")
-            self.connections[uid] = websocket
-            self.state[uid] = (False, "")
-            log.info(f"Connected {uid}")
-            return uid
         except WebSocketDisconnect:
             return None
+        settings = core.config.livecontrol
+        self.connections[uid] = Connection(
+            websocket,
+            settings.queue_size,
+            settings.slow_consumer,
+            lambda: self.snapshot(uid),
+            lambda: self.disconnect(uid),
+        )
+        self.state[uid] = (False, "")
+        log.info(f"Connected {uid}")
+        return uid
 
     def disconnect(self, uid: str):
         if uid in self.connections:
-            del self.connections[uid]
+            self.connections.pop(uid).task.cancel()
             del self.state[uid]
         log.info(f"Disconnected {uid}")
         return uid
 
-    async def activate(self, uid: str):
-        try:
-            await self.connections[uid].send_text("ACTIVATE")
-            self.state[uid] = (True, self.state[uid][1])
-        except KeyError:
-            raise HTTPException(404, "Not found.")
-        except WebSocketDisconnect:
-            self.disconnect(uid)
+    def snapshot(self, uid: str) -> list[str]:
+        active, content = self.state[uid]
+        return [f"UPDATE {content}", "ACTIVATE" if active else "DEACTIVATE"]
 
-    async def deactivate(self, uid: str):
-        try:
-            await self.connections[uid].send_text("DEACTIVATE")
-            self.state[uid] = (False, self.state[uid][1])
-        except KeyError:
+    def targets(self, uids: list[str] | None) -> list[str]:
+        if uids is None:
+            return list(self.connections)
+        if any(uid not in self.connections for uid in uids):
             raise HTTPException(404, "Not found.")
-        except WebSocketDisconnect:
-            self.disconnect(uid)
+        return uids
 
-    async def update(self, uid: str, content: str):
-        try:
-            await self.connections[uid].send_text(f"UPDATE {content}")
-            self.state[uid] = (self.state[uid][0], content)
-        except KeyError:
-            raise HTTPException(404, "Not found.")
-        except WebSocketDisconnect:
-            self.disconnect(uid)
+    def multicast(
+        self,
+        uids: list[str] | None,
+        message: str,
+        active: bool | None = None,
+        content: str | None = None,
+    ) -> list[str]:
+        targets = self.targets(uids)
+        for uid in targets:
+            old_active, old_content = self.state[uid]
+            self.state[uid] = (
+                old_active if active is None else active,
+                old_content if content is None else content,
+            )
+            self.connections[uid].send(message)
+        return targets
+
+    def activate(self, uids: list[str] | None = None) -> list[str]:
+        return self.multicast(uids, "ACTIVATE", active=True)
+
+    def deactivate(self, uids: list[str] | None = None) -> list[str]:
+        return self.multicast(uids, "DEACTIVATE", active=False)
+
+    def update(self, content: str, uids: list[str] | None = None) -> list[str]:
+        return self.multicast(uids, f"UPDATE {content}", content=content)
+
+    def dispatch(
+        self, command: str, content: str = "", uids: list[str] | None = None
+    ) -> list[str]:
+        match command:
+            case "ACTIVATE":
+                return self.activate(uids)
+            case "UPDATE":
+                return self.update(content, uids)
+            case "DEACTIVATE":
+                return self.deactivate(uids)
+        return []
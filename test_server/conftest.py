@@ -0,0 +1,116 @@
+import json
+import statistics
+import time
+import warnings
+from pathlib import Path
+
+import pytest
+
+from server import config, core
+
+BASELINE = Path(__file__).with_name("benchmarks.json")
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("benchmark")
+    group.addoption("--benchmark", action="store_true", help="Run the benchmark suite.")
+    group.addoption(
+        "--benchmark-baseline",
+        type=Path,
+        default=BASELINE,
+        help="Baseline file of nanoseconds per operation and machine calibration.",
+    )
+    group.addoption(
+        "--benchmark-threshold",
+        type=float,
+        default=1.0,
+        help="Allowed slowdown over the baseline, as a fraction.",
+    )
+    group.addoption(
+        "--benchmark-update",
+        action="store_true",
+        help="Overwrite the baseline with this run's results.",
+    )
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        "markers", "benchmark: performance regression check, run with --benchmark"
+    )
+    config.benchmarks = {}
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--benchmark"):
+        return
+    skip = pytest.mark.skip(reason="benchmarks run with --benchmark")
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(skip)
+
+
+def calibrate(rounds: int = 25) -> int:
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter_ns()
+        table = {}
+        for i in range(100_000):
+            table[str(i % 1000)] = i
+        timings.append(time.perf_counter_ns() - start)
+    return round(statistics.median(timings))
+
+
+def baseline(config) -> dict[str, dict[str, int]]:
+    path = config.getoption("--benchmark-baseline")
+    return json.loads(path.read_text()) if path.exists() else {}
+
+
+def pytest_sessionfinish(session):
+    results = session.config.benchmarks
+    if not (results and session.config.getoption("--benchmark-update")):
+        return
+    merged = baseline(session.config) | results
+    path = session.config.getoption("--benchmark-baseline")
+    path.write_text(json.dumps(dict(sorted(merged.items())), indent=2) + "\n")
+
+
+@pytest.fixture(scope="session")
+def calibration() -> int:
+    return calibrate()
+
+
+@pytest.fixture
+def benchmark(request, calibration):
+    config = request.config
+    previous = baseline(config)
+    threshold = config.getoption("--benchmark-threshold")
+
+    def record(name: str, ns: float, gate: bool = True):
+        config.benchmarks[name] = {"ns": round(ns), "calibration": calibration}
+        if config.getoption("--benchmark-update") or name not in previous:
+            return
+        expected = previous[name]["ns"] * calibration / previous[name]["calibration"]
+        message = (
+            f"{name} regressed: {ns:,.0f} ns/op against a baseline of "
+            f"{expected:,.0f} ns/op on this machine (+{threshold:.0%} allowed)"
+        )
+        if not gate:
+            if ns > expected * (1 + threshold):
+                warnings.warn(message)
+            return
+        assert ns <= expected * (1 + threshold), message
+
+    return record
+
+
+@pytest.fixture
+def configure():
+    def configure(**sections) -> config.Config:
+        sections.setdefault(
+            "admin", config.Admin(username="TEST", password_hash="TEST")
+        )
+        sections.setdefault("jwt", config.JWT(secret="TEST"))
+        core.config = config.Config(**sections)
+        return core.config
+
+    return configure
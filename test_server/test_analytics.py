@@ -0,0 +1,68 @@
+import asyncio
+import time
+from datetime import timedelta
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from server import analytics, config, requestdb
+
+
+def row(
+    path: str,
+    elapsed_ms: int,
+    status: int = 200,
+    client: str = "a",
+    weight: float = 1.0,
+) -> tuple:
+    return (
+        time.time_ns(),
+        elapsed_ms * 1_000_000,
+        "GET",
+        path,
+        None,
+        f"agent-{client}",
+        client,
+        None,
+        None,
+        status,
+        0,
+        0,
+        weight,
+        path,
+    )
+
+
+def test_analytics_from_rollup(configure):
+    async def run(database):
+        configure(locations=config.Locations(database=database))
+        await requestdb.opendb()
+        try:
+            for n in range(1, 101):
+                await requestdb.writer.put(row("/fast", n, client="a"))
+            await requestdb.writer.put(row("/slow", 1000, status=500, client="b"))
+            await requestdb.writer.put(row("/sampled", 1, weight=10))
+            await requestdb.writer.flush()
+            window = timedelta(hours=1)
+            return (
+                await analytics.routes("", window),
+                await analytics.traffic("", window, timedelta(hours=1)),
+                await analytics.top("", "client", window, 1),
+                await analytics.top("", "agent", window, 2),
+            )
+        finally:
+            await requestdb.closedb()
+
+    with TemporaryDirectory() as tmpdir:
+        routes, traffic, top, agents = asyncio.run(run(Path(tmpdir) / "test.sqlite3"))
+    fast, sampled, slow = routes
+    assert fast["route"] == "/fast" and fast["count"] == 100
+    assert 45 < fast["p50_ms"] < 55
+    assert 85 < fast["p90_ms"] < 95
+    assert slow == slow | {"route": "/slow", "count": 1, "errors": 1}
+    assert sampled == sampled | {"route": "/sampled", "count": 10}
+    assert sum(t["count"] for t in traffic) == 111
+    assert top == [{"client": "a", "count": 110}]
+    assert agents == [
+        {"agent": "agent-a", "count": 110},
+        {"agent": "agent-b", "count": 1},
+    ]
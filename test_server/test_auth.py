@@ -0,0 +1,106 @@
+import asyncio
+import threading
+import time
+from datetime import timedelta
+
+import jwt
+import pytest
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.security import OAuth2PasswordRequestForm
+from fastapi.testclient import TestClient
+
+from server import auth, config
+from server.auth_backends import PyJWT, hasher
+
+
+def test_token_cache_skips_repeat_verification(monkeypatch):
+    tokenizer = PyJWT()
+    token = tokenizer.tokenize({"id": "TEST"}, "SECRET", timedelta(minutes=5))
+    assert tokenizer.check(token, "SECRET")
+    monkeypatch.setattr(jwt, "decode", None)
+    assert tokenizer.check(token, "SECRET")
+    assert tokenizer.stats() == {
+        "hits": 1,
+        "misses": 1,
+        "entries": 1,
+        "hit_rate": 0.5,
+    }
+
+
+def test_token_cache_rejects_after_secret_change():
+    tokenizer = PyJWT()
+    token = tokenizer.tokenize({"id": "TEST"}, "SECRET", timedelta(minutes=5))
+    assert tokenizer.check(token, "SECRET")
+    assert not tokenizer.check(token, "ROTATED")
+    assert tokenizer.stats()["hits"] == 0
+
+
+def test_token_cache_expires_with_token():
+    tokenizer = PyJWT()
+    token = tokenizer.tokenize({"id": "TEST"}, "SECRET", timedelta(minutes=5))
+    assert tokenizer.check(token, "SECRET")
+    (key,) = tokenizer.verified
+    tokenizer.verified[key] = time.time() - 1
+    assert tokenizer.check(token, "SECRET")
+    assert tokenizer.stats()["misses"] == 2
+
+
+def test_token_cache_is_bounded():
+    tokenizer = PyJWT(cache_size=2)
+    for n in range(3):
+        token = tokenizer.tokenize({"id": str(n)}, "SECRET", timedelta(minutes=5))
+        assert tokenizer.check(token, "SECRET")
+    assert tokenizer.stats()["entries"] == 2
+
+
+@pytest.fixture
+def client(configure, monkeypatch):
+    configure(
+        admin=config.Admin(username="TEST", password_hash=hasher().hash("PASSWORD")),
+        login=config.Login(attempts=3),
+    )
+    monkeypatch.delattr(auth, "_throttle", raising=False)
+    app = FastAPI()
+    app.include_router(auth.api)
+    with TestClient(app) as client:
+        yield client
+
+
+def login(client: TestClient, password: str):
+    return client.post("/login", data={"username": "TEST", "password": password})
+
+
+def test_login_hashes_once_off_loop(client, monkeypatch):
+    calls = []
+    check = auth.hasher.check
+
+    def counted(text, hash):
+        calls.append(threading.current_thread().name)
+        return check(text, hash)
+
+    monkeypatch.setattr(auth.hasher, "check", counted)
+    response = login(client, "PASSWORD")
+    assert response.status_code == 200
+    assert PyJWT().check(response.json()["access_token"], "TEST")
+    assert len(calls) == 1 and calls[0].startswith("login")
+
+
+def test_login_limits_attempts_per_client(client):
+    assert [login(client, "WRONG").status_code for _ in range(3)] == [401] * 3
+    response = login(client, "PASSWORD")
+    assert response.status_code == 429
+    assert int(response.headers["retry-after"]) > 0
+
+
+def test_login_caps_concurrent_verification(client):
+    auth.throttle().inflight = auth.throttle().concurrency
+    assert login(client, "PASSWORD").status_code == 503
+
+
+def test_login_rejects_unknown_client(client):
+    form = OAuth2PasswordRequestForm(username="TEST", password="PASSWORD")
+    request = Request({"type": "http", "headers": [], "client": None})
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(auth.LoginRequest(request, form).authenticate())
+    assert error.value.status_code == 400
+    assert auth.throttle().history == {}
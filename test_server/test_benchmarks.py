@@ -0,0 +1,213 @@
+import asyncio
+import gc
+import json
+import statistics
+import time
+import zipfile
+from datetime import timedelta
+
+import pytest
+from fastapi import APIRouter, FastAPI, Response
+
+from bench.asgi import request, timeit
+from server import auth, config, livecontrol, requestdb, staticfiles
+from server.auth_backends import hasher
+
+pytestmark = pytest.mark.benchmark
+ROUNDS = 7
+REQUESTS = 500
+ASSETS = {
+    "public/index.html": "<html>" + "x" * 2000 + "</html>",
+    "public/assets/index-AbCd1234.js": "y" * 4096,
+}
+STATIC = {
+    "hit": "/assets/index-AbCd1234.js",
+    "miss": "/assets/missing.js",
+    "index": "/",
+}
+
+
+async def median(fn, n: int) -> float:
+    await fn()
+    gc.collect()
+    gc.disable()
+    try:
+        return statistics.median([await timeit(fn, n) for _ in range(ROUNDS)])
+    finally:
+        gc.enable()
+
+
+def bearer(token: str) -> list[tuple[str, str]]:
+    return [("Authorization", f"Bearer {token}")]
+
+
+def token() -> str:
+    return auth.tokenizer.tokenize({"id": "TEST"}, "TEST", timedelta(minutes=5))
+
+
+@pytest.fixture(params=["fs", "pyz"])
+def static(request, configure, monkeypatch, tmp_path):
+    configure()
+    if request.param == "pyz":
+        path = tmp_path / "site.pyz"
+        with zipfile.ZipFile(path, "w") as archive:
+            for name, content in ASSETS.items():
+                archive.writestr(name, content)
+        loader = staticfiles.PYZLoader(path)
+    else:
+        for name, content in ASSETS.items():
+            (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+            (tmp_path / name).write_text(content)
+        loader = staticfiles.FSLoader(tmp_path)
+    monkeypatch.setattr(staticfiles, "_loader", loader, raising=False)
+    app = FastAPI()
+    app.include_router(staticfiles.api)
+    return request.param, app
+
+
+@pytest.mark.parametrize("case", STATIC)
+def test_static(benchmark, static, case):
+    mode, app = static
+    benchmark(
+        f"static_{mode}_{case}",
+        asyncio.run(median(lambda: request(app, STATIC[case]), REQUESTS)),
+        gate=mode == "pyz",
+    )
+
+
+@pytest.mark.parametrize("valid", [True, False], ids=["valid", "invalid"])
+def test_auth(benchmark, configure, valid):
+    configure()
+    app = FastAPI()
+    app.include_router(livecontrol.api)
+    headers = bearer(token() if valid else "invalid")
+    name = "auth_valid" if valid else "auth_invalid"
+    benchmark(
+        name,
+        asyncio.run(
+            median(lambda: request(app, "/api/state", headers=headers), REQUESTS)
+        ),
+    )
+
+
+def test_login(benchmark, configure, monkeypatch):
+    configure(
+        admin=config.Admin(username="TEST", password_hash=hasher().hash("PASSWORD")),
+        login=config.Login(attempts=1_000_000),
+    )
+    monkeypatch.delattr(auth, "_throttle", raising=False)
+    app = FastAPI()
+    app.include_router(auth.api)
+    headers = [("Content-Type", "application/x-www-form-urlencoded")]
+    body = b"username=TEST&password=PASSWORD"
+
+    async def login():
+        messages = await request(app, "/login", "POST", headers, body)
+        assert messages[0]["status"] == 200
+
+    benchmark("login", asyncio.run(median(login, 3)))
+
+
+def test_log_requests(benchmark, configure, tmp_path):
+    configure(locations=config.Locations(database=tmp_path / "bench.sqlite3"))
+    router = APIRouter()
+
+    @router.get("/ping")
+    async def ping():
+        return Response(b"ok")
+
+    app, logged = FastAPI(), FastAPI()
+    app.include_router(router)
+    logged.include_router(router)
+    logged.add_middleware(requestdb.LogRequests)
+
+    async def run() -> tuple[float, float]:
+        await requestdb.opendb()
+        try:
+            return (
+                await median(lambda: request(app, "/ping"), REQUESTS),
+                await median(lambda: request(logged, "/ping"), REQUESTS),
+            )
+        finally:
+            await requestdb.closedb()
+
+    plain, with_logging = asyncio.run(run())
+    benchmark("request_unlogged", plain)
+    benchmark("request_logged", with_logging, gate=False)
+
+
+class FakeWebSocket:
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        pass
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+@pytest.mark.parametrize("clients", [10, 1000])
+def test_dispatch(benchmark, configure, clients):
+    configure(livecontrol=config.LiveControl(queue_size=1_000_000))
+    app = FastAPI()
+    app.include_router(livecontrol.api)
+    headers = bearer(token()) + [("Content-Type", "application/json")]
+    body = json.dumps({"command": "UPDATE", "content": "x" * 100, "all": True}).encode()
+    manager = livecontrol.manager
+
+    async def dispatch():
+        await request(app, "/api/dispatch", "POST", headers, body)
+        while any(c.queue for c in manager.connections.values()):
+            await asyncio.sleep(0)
+
+    async def run() -> float:
+        for _ in range(clients):
+            await manager.connect(FakeWebSocket())
+        try:
+            return await median(dispatch, 20)
+        finally:
+            await manager.stop()
+
+    benchmark(f"dispatch_{clients}", asyncio.run(run()))
+
+
+def test_requestdb_insert(benchmark, configure, tmp_path):
+    configure(
+        locations=config.Locations(database=tmp_path / "bench.sqlite3"),
+        requestlog=config.RequestLog(queue_size=1_000_000, max_age=False),
+    )
+    n = 5000
+    rows = [
+        (
+            time.time_ns(),
+            1_000_000 + i,
+            "GET",
+            f"/page/{i % 50}",
+            None,
+            f"agent-{i % 5}",
+            f"10.0.0.{i % 200}",
+            None,
+            None,
+            200,
+            500_000,
+            1024,
+            1.0,
+            "/page/{n}",
+        )
+        for i in range(n)
+    ]
+
+    async def insert():
+        for row in rows:
+            await requestdb.writer.put(row)
+        await requestdb.writer.flush()
+
+    async def run() -> float:
+        await requestdb.opendb()
+        try:
+            return await median(insert, 1) / n
+        finally:
+            await requestdb.closedb()
+
+    benchmark("requestdb_insert_per_row", asyncio.run(run()), gate=False)
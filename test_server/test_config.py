@@ -1,9 +1,12 @@
+import asyncio
 from datetime import timedelta
 from pathlib import Path
 from tempfile import NamedTemporaryFile
 
+import pytest
+from pydantic import ValidationError
 
-from server import config
+from server import api, config
 from server.auth_backends import hasher
 
 
@@ -47,3 +50,32 @@ secret = "TEST REBUILD SECRET"
         assert c.locations.static == Path("dist")
         assert c.rebuild.secret == "TEST REBUILD SECRET"
         assert c.rebuild.branch is None
+
+
+def test_unix_socket_peer_uses_rightmost_forwarded_address(configure):
+    configure(server=config.Server(uds=Path("s.sock")))
+
+    async def client(headers: list[tuple[bytes, bytes]], peer=None):
+        seen = {}
+
+        async def app(scope, receive, send):
+            seen.update(scope)
+
+        scope = {"type": "http", "client": peer, "headers": headers}
+        await api.UnixForwarded(app)(scope, None, None)
+        return seen["client"]
+
+    spoofed = [(b"x-forwarded-for", b"6.6.6.6, 203.0.113.7")]
+    assert asyncio.run(client(spoofed)) == ("203.0.113.7", 0)
+    chained = [(b"x-forwarded-for", b"6.6.6.6"), (b"x-forwarded-for", b"::1")]
+    assert asyncio.run(client(chained)) == ("6.6.6.6", 0)
+    assert asyncio.run(client([])) is None
+    assert asyncio.run(client(spoofed, ("10.0.0.2", 1))) == ("10.0.0.2", 1)
+    configure(server=config.Server(proxy_headers=False))
+    assert asyncio.run(client(spoofed)) is None
+
+
+def test_unix_socket_requires_proxy_headers():
+    with pytest.raises(ValidationError):
+        config.Server(uds=Path("s.sock"), proxy_headers=False)
+    assert not config.Server(proxy_headers=False).proxy_headers
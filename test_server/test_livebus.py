@@ -0,0 +1,142 @@
+import asyncio
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import pytest
+from fastapi import HTTPException
+
+from server import instruments
+from server.livebus import LiveBus
+from server.wsmanager import WSManager
+
+from .test_wsmanager import FakeWebSocket, connect
+
+
+def test_bus_routes_commands_to_owning_worker(configure):
+    configure()
+
+    async def run(directory: Path):
+        workers = [WSManager(), WSManager()]
+        buses = [LiveBus(directory, m, name) for m, name in zip(workers, "ab")]
+        for bus in buses:
+            await bus.start()
+        sockets = [FakeWebSocket(), FakeWebSocket()]
+        uids = [await connect(m, ws) for m, ws in zip(workers, sockets)]
+
+        await buses[0].dispatch("UPDATE", "hello", [uids[1]])
+        await buses[0].dispatch("ACTIVATE")
+        state = await buses[1].state()
+        with pytest.raises(HTTPException):
+            await buses[0].dispatch("ACTIVATE", uids=["a.missing", "c.missing"])
+        await asyncio.sleep(0)
+        for bus in buses:
+            await bus.stop()
+        return uids, sockets, state
+
+    with TemporaryDirectory() as tmpdir:
+        uids, sockets, state = asyncio.run(run(Path(tmpdir)))
+    assert [uid[0] for uid in uids] == ["a", "b"]
+    assert sockets[0].sent == ["CONNECT", "ACTIVATE"]
+    assert sockets[1].sent == ["CONNECT", "UPDATE hello", "ACTIVATE"]
+    assert state == {uids[0]: (True, ""), uids[1]: (True, "hello")}
+
+
+def test_bus_skips_stale_peers(configure):
+    configure()
+
+    async def run(directory: Path):
+        (directory / "gone.sock").touch()
+        bus = LiveBus(directory, WSManager(), "a")
+        await bus.start()
+        state = await bus.state()
+        await bus.stop()
+        return state
+
+    with TemporaryDirectory() as tmpdir:
+        assert asyncio.run(run(Path(tmpdir))) == {}
+        assert list(Path(tmpdir).iterdir()) == []
+
+
+def test_bus_reports_peers_that_do_not_reply(configure):
+    configure()
+
+    async def hang_up(reader, writer):
+        await reader.readline()
+        writer.close()
+
+    async def run(directory: Path):
+        manager = WSManager()
+        bus = LiveBus(directory, manager, "a")
+        await bus.start()
+        dead = await asyncio.start_unix_server(hang_up, path=directory / "b.sock")
+        uid = await connect(manager, FakeWebSocket())
+        broadcast = await bus.dispatch("ACTIVATE")
+        targeted = await bus.dispatch("DEACTIVATE", uids=[uid, "b.1"])
+        state = await bus.state()
+        dead.close()
+        await bus.stop()
+        return uid, broadcast, targeted, state
+
+    with TemporaryDirectory() as tmpdir:
+        uid, broadcast, targeted, state = asyncio.run(run(Path(tmpdir)))
+    assert broadcast == {"dispatched": [uid], "unreachable": ["b"]}
+    assert targeted == {"dispatched": [uid], "unreachable": ["b"]}
+    assert state == {uid: (False, "")}
+
+
+def test_bus_times_out_wedged_peers_and_ignores_unknown_owners(configure):
+    configure()
+    connections = []
+
+    async def wedge(reader, writer):
+        connections.append(writer)
+        await reader.read()
+
+    async def run(directory: Path):
+        (directory / "bus").mkdir()
+        bus = LiveBus(directory / "bus", WSManager(), "a", timeout=0.1)
+        await bus.start()
+        wedged = await asyncio.start_unix_server(
+            wedge, path=directory / "bus" / "b.sock"
+        )
+        outside = await asyncio.start_unix_server(wedge, path=directory / "x.sock")
+        broadcast = await bus.dispatch("ACTIVATE")
+        escaped = await bus.dispatch("ACTIVATE", uids=[f"{directory}/x.1"])
+        wedged.close()
+        outside.close()
+        await bus.stop()
+        return broadcast, escaped
+
+    with TemporaryDirectory() as tmpdir:
+        broadcast, escaped = asyncio.run(run(Path(tmpdir)))
+        assert escaped == {"dispatched": [], "unreachable": [f"{tmpdir}/x"]}
+    assert broadcast == {"dispatched": [], "unreachable": ["b"]}
+    assert len(connections) == 1
+
+
+def test_bus_sums_metrics_across_workers(configure):
+    configure()
+    counter = instruments.Counter("test_total", "Test.")
+    histogram = instruments.Histogram("test_seconds", "Test.", "route", (1.0,))
+    counter.inc(3)
+    histogram.labels("/a").observe(0.5)
+
+    async def run(directory: Path):
+        buses = [LiveBus(directory, WSManager(), name) for name in "ab"]
+        for bus in buses:
+            await bus.start()
+        text = instruments.render(await buses[0].metrics())
+        for bus in buses:
+            await bus.stop()
+        return text
+
+    try:
+        with TemporaryDirectory() as tmpdir:
+            text = asyncio.run(run(Path(tmpdir)))
+    finally:
+        instruments.registry.remove(counter)
+        instruments.registry.remove(histogram)
+    assert text.count("# TYPE test_total counter") == 1
+    assert "test_total 6\n" in text
+    assert 'test_seconds_bucket{route="/a",le="1.0"} 2\n' in text
+    assert 'test_seconds_sum{route="/a"} 1.0\n' in text
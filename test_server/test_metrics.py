@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+
+from server import instruments, metrics
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = instruments.Histogram("test_seconds", "Test.", buckets=(0.1, 1.0))
+    instruments.registry.remove(histogram)
+    for value in (0.05, 0.1, 0.5, 5.0):
+        histogram.observe(value)
+    assert list(histogram.samples()) == [
+        ("_bucket", '{le="0.1"}', 2),
+        ("_bucket", '{le="1.0"}', 3),
+        ("_bucket", '{le="+Inf"}', 4),
+        ("_sum", "", 5.65),
+        ("_count", "", 4),
+    ]
+
+
+def test_metric_requires_samples():
+    with pytest.raises(TypeError):
+        instruments.Metric("test", "Test.")
+
+
+def test_instrument_observes_route_template():
+    app = FastAPI()
+
+    @app.get("/items/{item}")
+    async def item(item: str):
+        return item
+
+    app.add_middleware(metrics.Instrument, routes=app.routes)
+
+    async def get(path: str):
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "path": path,
+            "raw_path": path.encode(),
+            "root_path": "",
+            "query_string": b"",
+            "headers": [],
+        }
+
+        async def receive():
+            return {"type": "http.request", "body": b""}
+
+        async def send(message):
+            pass
+
+        await app(scope, receive, send)
+
+    before = sum(metrics.latency.labels("/items/{item}").counts)
+    asyncio.run(get("/items/a"))
+    asyncio.run(get("/items/b"))
+    asyncio.run(get("/missing"))
+    assert sum(metrics.latency.labels("/items/{item}").counts) == before + 2
+    assert sum(metrics.latency.labels(metrics.UNMATCHED).counts) >= 1
+    assert metrics.inflight.value == 0
+    text = instruments.render()
+    assert "# TYPE aidan_http_request_duration_seconds histogram" in text
+    assert (
+        'aidan_http_request_duration_seconds_count{route="/items/{item}"}' in text
+    )
+    assert "# TYPE aidan_login_hash_seconds histogram" in text
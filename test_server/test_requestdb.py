@@ -0,0 +1,456 @@
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import aiosqlite
+import pytest
+
+from server import config, requestdb
+
+
+def row(n: int) -> tuple:
+    return (
+        n,
+        0,
+        "GET",
+        f"/{n}",
+        None,
+        "test",
+        "127.0.0.1",
+        None,
+        None,
+        200,
+        0,
+        0,
+        1.0,
+        "/{n}",
+    )
+
+
+async def count(database: Path) -> int:
+    async with (
+        aiosqlite.connect(database) as conn,
+        conn.execute("SELECT COUNT(*) FROM requests") as cursor,
+    ):
+        return (await cursor.fetchone())[0]
+
+
+async def pragma(conn: aiosqlite.Connection, name: str) -> int:
+    async with conn.execute(f"PRAGMA {name};") as cursor:
+        return (await cursor.fetchone())[0]
+
+
+def test_flush_on_batch_size(configure):
+    async def run(database):
+        configure(
+            locations=config.Locations(database=database),
+            requestlog=config.RequestLog(
+                batch_size=10, flush_interval=60, max_age=False
+            ),
+        )
+        await requestdb.opendb()
+        for n in range(25):
+            await requestdb.writer.put(row(n))
+        await asyncio.sleep(0.1)
+        flushed = await count(database)
+        await requestdb.closedb()
+        return flushed, await count(database)
+
+    with TemporaryDirectory() as tmpdir:
+        flushed, final = asyncio.run(run(Path(tmpdir) / "test.sqlite3"))
+        assert flushed == final == 25
+
+
+def test_drop_oldest_on_overflow(configure):
+    async def run(database):
+        configure(
+            locations=config.Locations(database=database),
+            requestlog=config.RequestLog(
+                queue_size=5, batch_size=100, flush_interval=60, max_age=False
+            ),
+        )
+        await requestdb.opendb()
+        for n in range(8):
+            await requestdb.writer.put(row(n))
+        dropped = requestdb.writer.dropped
+        await requestdb.closedb()
+        async with (
+            aiosqlite.connect(database) as conn,
+            conn.execute("SELECT received_ts_ns FROM requests") as cursor,
+        ):
+            return dropped, [r[0] for r in await cursor.fetchall()]
+
+    with TemporaryDirectory() as tmpdir:
+        dropped, received = asyncio.run(run(Path(tmpdir) / "test.sqlite3"))
+        assert dropped == 3
+        assert received == [3, 4, 5, 6, 7]
+
+
+def test_block_on_overflow(configure):
+    async def run(database):
+        configure(
+            locations=config.Locations(database=database),
+            requestlog=config.RequestLog(
+                queue_size=5, batch_size=5, flush_interval=60, overflow="block"
+            ),
+        )
+        await requestdb.opendb()
+        for n in range(12):
+            await requestdb.writer.put(row(n))
+        await requestdb.closedb()
+        return await count(database)
+
+    with TemporaryDirectory() as tmpdir:
+        assert asyncio.run(run(Path(tmpdir) / "test.sqlite3")) == 12
+
+
+def test_log_requests_observes_streamed_response(configure):
+    from fastapi.responses import StreamingResponse
+
+    async def app(scope, receive, send):
+        await StreamingResponse(iter([b"a", b"bc", b"def"]))(scope, receive, send)
+
+    async def run(database):
+        configure(
+            locations=config.Locations(database=database),
+            requestlog=config.RequestLog(),
+        )
+        await requestdb.opendb()
+        messages = []
+
+        async def receive():
+            await asyncio.sleep(60)
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0", "spec_version": "2.4"},
+            "method": "GET",
+            "scheme": "http",
+            "path": "/stream",
+            "query_string": b"",
+            "headers": [],
+            "server": ("test", 80),
+        }
+        await requestdb.LogRequests(app)(scope, receive, send)
+        await requestdb.closedb()
+        async with (
+            aiosqlite.connect(database) as conn,
+            conn.execute(
+                "SELECT status, bytes_sent, ttfb_ns <= elapsed_ns FROM requests"
+            ) as cursor,
+        ):
+            return messages, await cursor.fetchall()
+
+    with TemporaryDirectory() as tmpdir:
+        messages, rows = asyncio.run(run(Path(tmpdir) / "test.sqlite3"))
+        assert [m.get("body") for m in messages[1:]] == [b"a", b"bc", b"def", b""]
+        assert rows == [(200, 6, 1)]
+
+
+def test_retention_deletes_in_batches_and_vacuums(configure):
+    async def run(database):
+        configure(
+            locations=config.Locations(database=database),
+            requestlog=config.RequestLog(max_age=False),
+        )
+        await requestdb.opendb()
+        now = time.time_ns()
+        await requestdb.writer.write([row(n) for n in range(5000)])
+        await requestdb.writer.write([row(now + n) for n in range(100)])
+        pages = await pragma(requestdb.db, "page_count")
+        deleted = await requestdb.retain(requestdb.db, 3600, None, 1000)
+        after_age = await count(database)
+        deleted += await requestdb.retain(requestdb.db, None, 10, 1000)
+        shrunk = await pragma(requestdb.db, "page_count") < pages
+        await requestdb.closedb()
+        return deleted, after_age, await count(database), shrunk
+
+    with TemporaryDirectory() as tmpdir:
+        deleted, after_age, final, shrunk = asyncio.run(
+            run(Path(tmpdir) / "test.sqlite3")
+        )
+        assert (deleted, after_age, final) == (5090, 100, 10)
+        assert shrunk
+
+
+def test_rows_are_interned_and_redacted(configure):
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 204, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def send(message):
+        pass
+
+    async def run(database):
+        configure(locations=config.Locations(database=database))
+        await requestdb.opendb()
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "path": "/page",
+            "query_string": b"token=abc&page=2",
+            "client": ("10.0.0.1", 1234),
+            "headers": [
+                (b"user-agent", b"test-agent"),
+                (b"host", b"example.com"),
+                (b"x-private", b"hidden"),
+                (b"cookie", b"Authorization=jwt; theme=dark"),
+            ],
+        }
+        for _ in range(3):
+            await requestdb.LogRequests(app)(scope, None, send)
+        await requestdb.closedb()
+        async with aiosqlite.connect(database) as conn:
+            async with conn.execute(
+                "SELECT m.value, p.value, a.value, query, client, headers, cookies"
+                " FROM requests JOIN methods m ON m.id = method"
+                " JOIN paths p ON p.id = path JOIN agents a ON a.id = agent;"
+            ) as cursor:
+                rows = await cursor.fetchall()
+            async with conn.execute("SELECT COUNT(*) FROM paths;") as cursor:
+                return rows, (await cursor.fetchone())[0]
+
+    with TemporaryDirectory() as tmpdir:
+        rows, paths = asyncio.run(run(Path(tmpdir) / "test.sqlite3"))
+    assert paths == 1
+    assert (
+        rows
+        == [
+            (
+                "GET",
+                "/page",
+                "test-agent",
+                '{"token":"<redacted>","page":"2"}',
+                "10.0.0.1",
+                '{"host":"example.com"}',
+                '{"Authorization":"<redacted>","theme":"dark"}',
+            )
+        ]
+        * 3
+    )
+
+
+def test_legacy_rows_are_compacted(configure):
+    async def run(database):
+        async with aiosqlite.connect(database) as conn:
+            for statement in requestdb.MIGRATIONS[:7]:
+                await conn.execute(statement)
+            await conn.execute("PRAGMA user_version = 7;")
+            await conn.execute(
+                "INSERT INTO requests(received_ts_ns, elapsed_ns, method, url,"
+                " headers, client, cookies, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?);",
+                (
+                    1,
+                    2,
+                    "GET",
+                    "http://test/legacy?x=1",
+                    "Headers({'user-agent': 'old-agent', 'cookie': 'secret'})",
+                    "Address(host='10.0.0.2', port=80)",
+                    "{'Authorization': 'secret'}",
+                    200,
+                ),
+            )
+            await conn.commit()
+        configure(
+            locations=config.Locations(database=database),
+            requestlog=config.RequestLog(max_age=False),
+        )
+        await requestdb.opendb()
+        await requestdb.closedb()
+        async with (
+            aiosqlite.connect(database) as conn,
+            conn.execute(
+                "SELECT received_ts_ns, p.value, a.value, query, client, cookies"
+                " FROM requests JOIN paths p ON p.id = path"
+                " JOIN agents a ON a.id = agent;"
+            ) as cursor,
+        ):
+            return await cursor.fetchall()
+
+    with TemporaryDirectory() as tmpdir:
+        rows = asyncio.run(run(Path(tmpdir) / "test.sqlite3"))
+    assert rows == [(1, "/legacy", "old-agent", '{"x":"1"}', "10.0.0.2", None)]
+
+
+def test_segments_are_compacted_and_exported(configure):
+    async def run(tmp: Path):
+        configure(
+            locations=config.Locations(
+                database=tmp / "test.sqlite3", segments=tmp / "segments"
+            ),
+            requestlog=config.RequestLog(max_age=False, segment_bytes=500),
+        )
+        await requestdb.opendb()
+        for n in range(20):
+            await requestdb.writer.put(row(n))
+        await requestdb.writer.flush()
+        segments = len(list((tmp / "segments").glob("*.log")))
+        loaded = await requestdb.load(requestdb.db, tmp / "segments", {}, 7)
+        await requestdb.writer.put(row(20))
+        await requestdb.closedb()
+        return segments, loaded
+
+    with TemporaryDirectory() as tmpdir:
+        tmp = Path(tmpdir)
+        segments, loaded = asyncio.run(run(tmp))
+        assert segments > 1
+        assert 0 < loaded <= 20
+        assert asyncio.run(count(tmp / "test.sqlite3")) == 21
+        (tmp / "segments" / "9-1.log").write_text(json.dumps(row(21)) + "\n")
+        exported = list(requestdb.records(tmp / "test.sqlite3", tmp / "segments", 5))
+        assert sorted(r["received_ts_ns"] for r in exported) == list(range(5, 22))
+        assert {r["path"] for r in exported} == {f"/{n}" for n in range(5, 22)}
+
+
+def test_concurrent_puts_share_one_segment(tmp_path):
+    async def run():
+        writer = requestdb.SegmentWriter(tmp_path, 1_000_000, 60)
+        await asyncio.gather(*(writer.put(row(n)) for n in range(10)))
+        await writer.close()
+
+    asyncio.run(run())
+    (segment,) = tmp_path.glob("*.log")
+    assert len(segment.read_text().splitlines()) == 10
+
+
+def test_orphaned_segments_are_recovered(tmp_path):
+    dead = subprocess.Popen(["true"])
+    dead.wait()
+    (tmp_path / f"1-{dead.pid}.open").write_text("[]\n")
+    (tmp_path / f"2-1.{dead.pid}.load").write_text("[]\n")
+    (tmp_path / f"3-{os.getpid()}.open").write_text("[]\n")
+    requestdb.recover(tmp_path)
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        f"1-{dead.pid}.log",
+        "2-1.log",
+        f"3-{os.getpid()}.open",
+    ]
+
+
+def test_capture_policy():
+    capture = requestdb.Capture(
+        [("/assets/", 0.1), ("/assets/keep/", 1.0), ("/skip/", 0.0)], 400, 1000
+    )
+    random.seed(0)
+    weights = [capture.weight("/assets/x.js", 200, 0) for _ in range(10_000)]
+    sampled = [w for w in weights if w is not None]
+    assert 800 < len(sampled) < 1200
+    assert set(sampled) == {10}
+    assert capture.weight("/assets/keep/x.js", 200, 0) == 1
+    assert capture.weight("/skip/x", 200, 0) is None
+    assert capture.weight("/skip/x", 404, 0) == 1
+    assert capture.weight("/skip/x", 200, 1000) == 1
+    assert capture.weight("/other", 200, 0) == 1
+
+
+def test_failed_segment_load_is_rolled_back_and_retried(configure, monkeypatch):
+    async def run(tmp: Path):
+        configure(
+            locations=config.Locations(database=tmp / "test.sqlite3"),
+            requestlog=config.RequestLog(max_age=False),
+        )
+        await requestdb.opendb()
+        segments = tmp / "segments"
+        segments.mkdir()
+        (segments / "1-1.log").write_text(
+            "".join(json.dumps(row(n)) + "\n" for n in range(3))
+        )
+        cache: dict[str, dict[str, int]] = {}
+        rollup = requestdb.ROLLUP
+        monkeypatch.setattr(requestdb, "ROLLUP", "INSERT INTO missing VALUES (?)")
+        with pytest.raises(sqlite3.Error):
+            await requestdb.load(requestdb.db, segments, cache, 2)
+        await requestdb.db.commit()
+        retried = [p.name for p in segments.iterdir()]
+        monkeypatch.setattr(requestdb, "ROLLUP", rollup)
+        loaded = await requestdb.load(requestdb.db, segments, cache, 2)
+        await requestdb.closedb()
+        return retried, loaded
+
+    with TemporaryDirectory() as tmpdir:
+        tmp = Path(tmpdir)
+        retried, loaded = asyncio.run(run(tmp))
+        assert retried == ["1-1.log"]
+        assert loaded == 3
+        assert asyncio.run(count(tmp / "test.sqlite3")) == 3
+
+
+def test_failed_batch_is_rolled_back(configure, monkeypatch):
+    async def run(database):
+        configure(
+            locations=config.Locations(database=database),
+            requestlog=config.RequestLog(max_age=False),
+        )
+        await requestdb.opendb()
+        rollup = requestdb.ROLLUP
+        monkeypatch.setattr(requestdb, "ROLLUP", "INSERT INTO missing VALUES (?)")
+        await requestdb.writer.write([row(n) for n in range(5)])
+        interned = dict(requestdb.writer.interned)
+        monkeypatch.setattr(requestdb, "ROLLUP", rollup)
+        await requestdb.writer.write([row(5)])
+        await requestdb.closedb()
+        return interned, await count(database)
+
+    with TemporaryDirectory() as tmpdir:
+        interned, final = asyncio.run(run(Path(tmpdir) / "test.sqlite3"))
+        assert interned == {}
+        assert final == 1
+
+
+def test_rollup_is_keyed_by_route_template(configure):
+    from fastapi import FastAPI
+
+    app = FastAPI()
+
+    @app.get("/items/{item}")
+    async def item(item: str):
+        return item
+
+    async def run(database):
+        configure(
+            locations=config.Locations(database=database),
+            requestlog=config.RequestLog(max_age=False),
+        )
+        await requestdb.opendb()
+        logged = requestdb.LogRequests(app)
+
+        async def receive():
+            return {"type": "http.request", "body": b""}
+
+        async def send(message):
+            pass
+
+        for path in ["/items/a", "/items/b", "/missing-1", "/missing-2"]:
+            scope = {
+                "type": "http",
+                "method": "GET",
+                "path": path,
+                "raw_path": path.encode(),
+                "root_path": "",
+                "query_string": b"",
+                "headers": [],
+            }
+            await logged(scope, receive, send)
+        await requestdb.closedb()
+        async with (
+            aiosqlite.connect(database) as conn,
+            conn.execute(
+                "SELECT route, SUM(count) FROM rollup GROUP BY route ORDER BY route"
+            ) as cursor,
+        ):
+            return await cursor.fetchall()
+
+    with TemporaryDirectory() as tmpdir:
+        assert asyncio.run(run(Path(tmpdir) / "test.sqlite3")) == [
+            ("/items/{item}", 2),
+            ("unmatched", 2),
+        ]
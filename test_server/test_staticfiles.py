@@ -0,0 +1,341 @@
+import asyncio
+import gzip
+import json
+import zipfile
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import pytest
+from fastapi import Request
+
+from server import config, staticfiles
+
+
+@pytest.fixture
+def pyz():
+    with TemporaryDirectory() as tmpdir:
+        path = Path(tmpdir) / "test.pyz"
+        with open(path, "wb") as f:
+            f.write(b"#!/usr/bin/env python\n")
+            with zipfile.ZipFile(f, "w", zipfile.ZIP_DEFLATED) as archive:
+                archive.writestr("public/index.html", "<html></html>")
+                archive.writestr("public/assets/index.js", "x" * 100)
+                archive.writestr("public/assets/big.js", "y" * 1000)
+                archive.writestr(
+                    "public/assets/stored.css", "z" * 300, zipfile.ZIP_STORED
+                )
+        yield path
+
+
+def request(accept_encoding: str) -> Request:
+    headers = [(b"accept-encoding", accept_encoding.encode())]
+    return Request({"type": "http", "headers": headers})
+
+
+def test_asset_cache_evicts_least_recently_used():
+    cache = staticfiles.AssetCache(max_bytes=10)
+    cache.get("a", lambda: b"aaaa")
+    cache.get("b", lambda: b"bbbb")
+    cache.get("a", lambda: b"")
+    cache.get("c", lambda: b"cccc")
+    assert list(cache.entries) == ["a", "c"]
+    assert cache.stats() == {
+        "hits": 1,
+        "misses": 3,
+        "evictions": 1,
+        "entries": 2,
+        "bytes": 8,
+    }
+
+
+def served(response) -> bytes:
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(response({"type": "http"}, None, send))
+    return b"".join(m.get("body", b"") for m in messages)
+
+
+def test_pyz_loader_serves_from_cache(configure, pyz):
+    configure(staticfiles=config.StaticFiles(cache_bytes=500))
+    loader = staticfiles.PYZLoader(pyz)
+    response = loader.response(request(""), "public", "assets/index.js")
+    assert response.headers["content-length"] == "100"
+    assert loader.cache.stats()["misses"] == 0
+    assert served(response) == b"x" * 100
+    assert served(loader.response(request(""), "public", "assets/index.js")) == (
+        b"x" * 100
+    )
+    assert served(loader.response(request(""), "public", "")) == b"<html></html>"
+    assert loader.cache.stats()["hits"] == 1
+    assert loader.cache.stats()["misses"] == 2
+
+
+def test_pyz_loader_streams_assets_over_budget(configure, pyz):
+    configure(staticfiles=config.StaticFiles(cache_bytes=500))
+    loader = staticfiles.PYZLoader(pyz)
+    response = loader.response(request(""), "public", "assets/big.js")
+    assert not hasattr(response, "body")
+    assert loader.cache.stats()["entries"] == 0
+
+
+def test_accepted_encodings():
+    assert staticfiles.accepted_encodings(request("gzip, br")) == ["br", "gzip"]
+    assert staticfiles.accepted_encodings(request("gzip;q=1, br;q=0")) == ["gzip"]
+    assert staticfiles.accepted_encodings(request("*")) == ["br", "gzip"]
+    assert staticfiles.accepted_encodings(request("identity")) == []
+
+
+def test_fs_loader_serves_precompressed_variant(configure):
+    with TemporaryDirectory() as tmpdir:
+        static = Path(tmpdir)
+        (static / "public").mkdir()
+        (static / "public" / "index.js").write_text("x" * 100)
+        (static / "public" / "index.js.gz").write_bytes(gzip.compress(b"x" * 100))
+        configure()
+        loader = staticfiles.FSLoader(static)
+
+        response = loader.response(request("gzip, br"), "public", "index.js")
+        assert response.path == static / "public" / "index.js.gz"
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.headers["vary"] == "Accept-Encoding"
+        assert response.media_type == "text/javascript"
+
+        response = loader.response(request("br"), "public", "index.js")
+        assert response.path == static / "public" / "index.js"
+        assert "content-encoding" not in response.headers
+        assert response.headers["vary"] == "Accept-Encoding"
+
+
+def test_pyz_loader_serves_precompressed_variant(configure, pyz):
+    with zipfile.ZipFile(pyz, "a") as archive:
+        archive.writestr("public/assets/index.js.br", b"brotli")
+    configure()
+    loader = staticfiles.PYZLoader(pyz)
+    response = loader.response(request("gzip, br"), "public", "assets/index.js")
+    assert response.body == b"brotli"
+    assert response.headers["content-encoding"] == "br"
+    assert response.media_type == "text/javascript"
+
+
+def test_index_routes_directories_and_skips_variants():
+    def asset(name):
+        return staticfiles.Asset(name, 1, 0, None, "text/html")
+
+    names = ["public/index.html", "public/login/index.html", "public/a.js"]
+    routes = staticfiles.index({n: asset(n) for n in names + ["public/a.js.gz"]})
+    assert set(routes) == {
+        "public",
+        "public/index.html",
+        "public/login",
+        "public/login/index.html",
+        "public/a.js",
+    }
+    assert routes["public/a.js"].variants["gzip"].name == "public/a.js.gz"
+    assert staticfiles.lookup(routes, "public", "/login/").name == names[1]
+    assert staticfiles.lookup(routes, "public", "").name == names[0]
+    with pytest.raises(staticfiles.FileNotFound):
+        staticfiles.lookup(routes, "public", "../server/api.py")
+
+
+def test_fs_loader_reindexes_on_change(configure):
+    with TemporaryDirectory() as tmpdir:
+        static = Path(tmpdir)
+        (static / "public").mkdir()
+        configure()
+        loader = staticfiles.FSLoader(static)
+        with pytest.raises(staticfiles.FileNotFound):
+            loader.response(request(""), "public", "")
+        assert not loader.changed()
+        (static / "public" / "index.html").write_text("<html></html>")
+        assert loader.changed()
+        loader.signature, loader.routes = loader.scan()
+        response = loader.response(request(""), "public", "")
+        assert response.path == static / "public" / "index.html"
+
+
+async def body(response) -> bytes:
+    if hasattr(response, "body"):
+        return response.body
+    return b"".join([chunk async for chunk in response.body_iterator])
+
+
+def headers(**kwargs) -> Request:
+    raw = [(k.replace("_", "-").encode(), v.encode()) for k, v in kwargs.items()]
+    return Request({"type": "http", "headers": raw})
+
+
+@pytest.fixture(params=["fs", "pyz"])
+def loader(request, configure, pyz):
+    configure()
+    if request.param == "pyz":
+        yield staticfiles.PYZLoader(pyz)
+        return
+    with TemporaryDirectory() as tmpdir:
+        with zipfile.ZipFile(pyz) as archive:
+            archive.extractall(tmpdir)
+        yield staticfiles.FSLoader(Path(tmpdir))
+
+
+def test_conditional_get(loader):
+    response = loader.response(headers(), "public", "assets/index.js")
+    etag = response.headers["etag"]
+    last_modified = response.headers["last-modified"]
+    response = loader.response(headers(if_none_match=etag), "public", "assets/index.js")
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    response = loader.response(
+        headers(if_modified_since=last_modified), "public", "assets/index.js"
+    )
+    assert response.status_code == 304
+    response = loader.response(
+        headers(if_none_match='"x"'), "public", "assets/index.js"
+    )
+    assert response.status_code == 200
+
+
+def test_single_range(loader):
+    response = loader.response(headers(range="bytes=10-19"), "public", "assets/big.js")
+    assert response.status_code == 206
+    assert response.headers["content-range"] == "bytes 10-19/1000"
+    assert asyncio.run(body(response)) == b"y" * 10
+
+    response = loader.response(headers(range="bytes=-5"), "public", "assets/big.js")
+    assert response.headers["content-range"] == "bytes 995-999/1000"
+
+
+def test_multiple_ranges(loader):
+    response = loader.response(
+        headers(range="bytes=0-1, 98-"), "public", "assets/index.js"
+    )
+    assert response.status_code == 206
+    boundary = response.media_type.split("boundary=")[1]
+    content = asyncio.run(body(response)).decode()
+    parts = content.split(f"--{boundary}")
+    assert parts[0] == "" and parts[-1] == "--\r\n"
+    assert "Content-Range: bytes 0-1/100\r\n\r\nxx\r\n" in parts[1]
+    assert "Content-Range: bytes 98-99/100\r\n\r\nxx\r\n" in parts[2]
+
+
+def test_unsatisfiable_and_stale_ranges(loader):
+    response = loader.response(headers(range="bytes=500-"), "public", "assets/index.js")
+    assert response.status_code == 416
+    assert response.headers["content-range"] == "bytes */100"
+    response = loader.response(
+        headers(range="bytes=0-1", if_range='"stale"'), "public", "assets/index.js"
+    )
+    assert response.status_code == 200
+
+
+def test_pyz_loader_maps_stored_members(configure, pyz):
+    configure()
+    loader = staticfiles.PYZLoader(pyz)
+    assert loader.routes["public/assets/index.js"].offset is None
+    response = loader.response(headers(), "public", "assets/stored.css")
+    assert isinstance(response.body, memoryview)
+    assert response.body == b"z" * 300
+    assert response.headers["content-length"] == "300"
+    assert loader.cache.stats()["misses"] == 0
+    response = loader.response(
+        headers(range="bytes=1-2"), "public", "assets/stored.css"
+    )
+    assert asyncio.run(body(response)) == b"zz"
+
+
+def test_classify_cache_policy():
+    assert staticfiles.classify("public/assets/index-AbCd1234.js") == "immutable"
+    assert staticfiles.classify("protected/assets/index-AbCd_-34.css") == "immutable"
+    assert staticfiles.classify("public/assets/theme.css") == "short"
+    assert staticfiles.classify("public/index.html") == "no-cache"
+    assert staticfiles.classify("public/login/assets/index-AbCd1234.js") == "no-cache"
+
+
+def test_manifest_drives_cache_headers(configure):
+    with TemporaryDirectory() as tmpdir:
+        static = Path(tmpdir)
+        for name in ["public/index.html", "public/assets/index-AbCd1234.js"]:
+            (static / name).parent.mkdir(parents=True, exist_ok=True)
+            (static / name).write_text(name)
+        (static / "protected").mkdir()
+        (static / "protected" / "index.html").write_text("protected")
+        (static / "manifest.json").write_text(
+            '{"public/assets/index-AbCd1234.js": {"hash": "abc", "cache": "immutable"}}'
+        )
+        configure()
+        loader = staticfiles.FSLoader(static)
+
+        response = loader.response(request(""), "public", "assets/index-AbCd1234.js")
+        assert response.headers["etag"] == '"abc"'
+        assert (
+            response.headers["cache-control"] == "public, max-age=31536000, immutable"
+        )
+        assert loader.response(request(""), "public", "").headers["cache-control"] == (
+            "public, no-cache"
+        )
+        assert (
+            loader.response(request(""), "protected", "").headers["cache-control"]
+            == "private, no-cache"
+        )
+
+        revalidate = Request(
+            {"type": "http", "headers": [(b"if-none-match", b'"abc"')]}
+        )
+        response = loader.response(revalidate, "public", "assets/index-AbCd1234.js")
+        assert response.status_code == 304
+        assert "immutable" in response.headers["cache-control"]
+
+
+def test_entry_html_sends_preload_links_and_early_hints(configure, pyz):
+    links = ["</assets/index-AbCd1234.js>; rel=modulepreload"]
+    with zipfile.ZipFile(pyz, "a") as archive:
+        archive.writestr(
+            "manifest.json", json.dumps({"public/index.html": {"preload": links}})
+        )
+    configure()
+    loader = staticfiles.PYZLoader(pyz)
+    response = loader.response(request(""), "public", "")
+    assert response.headers["link"] == links[0]
+    assert response.body == response.response.body
+    assert response.background is None
+
+    async def run(extensions):
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {"type": "http", "extensions": extensions}
+        await response(scope, None, send)
+        return [m["type"] for m in messages], messages[0]
+
+    types, hint = asyncio.run(run({"http.response.early_hint": {}}))
+    assert types == [
+        "http.response.early_hint",
+        "http.response.start",
+        "http.response.body",
+    ]
+    assert hint["links"] == [links[0].encode()]
+    types, _ = asyncio.run(run({}))
+    assert types == ["http.response.start", "http.response.body"]
+    assert (
+        "link" not in loader.response(request(""), "public", "assets/index.js").headers
+    )
+
+
+def test_fs_loader_serves_current_stat_after_in_place_rewrite(configure):
+    with TemporaryDirectory() as tmpdir:
+        static = Path(tmpdir)
+        (static / "public").mkdir()
+        path = static / "public" / "index.js"
+        path.write_text("x" * 18)
+        configure()
+        loader = staticfiles.FSLoader(static)
+        etag = loader.response(request(""), "public", "index.js").headers["etag"]
+        with open(path, "w") as f:
+            f.write("y" * 108)
+        response = loader.response(request(""), "public", "index.js")
+        assert response.headers["content-length"] == "108"
+        assert response.headers["etag"] != etag
+        assert loader.changed()
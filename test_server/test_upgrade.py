@@ -0,0 +1,87 @@
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+import pytest
+
+from server import config, upgrade
+
+CHILD = f"""
+import os, pathlib, socket
+sock = socket.socket(fileno=int(os.environ[{upgrade.LISTENER_FD!r}]))
+pathlib.Path(os.environ[{upgrade.READY_FILE!r}]).write_text(str(sock.getsockname()[1]))
+"""
+
+
+@pytest.fixture
+def kills(monkeypatch):
+    sent = []
+    monkeypatch.setattr(upgrade.os, "kill", lambda pid, sig: sent.append((pid, sig)))
+    listener = socket.create_server(("127.0.0.1", 0))
+    listener.set_inheritable(True)
+    monkeypatch.setattr(upgrade, "listener", listener)
+    monkeypatch.setattr(upgrade, "upgrading", threading.Lock())
+    yield sent
+    listener.close()
+
+
+def test_handover_drains_after_ready(monkeypatch, kills):
+    monkeypatch.setattr(upgrade, "command", lambda: [sys.executable, "-c", CHILD])
+    upgrade.handover()
+    assert kills == [(os.getpid(), signal.SIGTERM)]
+
+
+def test_handover_keeps_running_on_failure(monkeypatch, kills):
+    monkeypatch.setattr(upgrade, "command", lambda: [sys.executable, "-c", "exit(1)"])
+    upgrade.handover()
+    assert kills == []
+
+
+def test_listen_inherits_socket(monkeypatch):
+    inherited = socket.create_server(("127.0.0.1", 0))
+    monkeypatch.setenv(upgrade.LISTENER_FD, str(inherited.fileno()))
+    listener = upgrade.listen("127.0.0.1", 0)
+    assert listener.fileno() == inherited.fileno()
+    assert upgrade.LISTENER_FD not in os.environ
+    inherited.detach()
+    listener.close()
+
+
+def test_listen_binds_unix_socket(monkeypatch, tmp_path):
+    monkeypatch.delenv(upgrade.LISTENER_FD, raising=False)
+    path = tmp_path / "server.sock"
+    path.write_text("stale")
+    listener = upgrade.listen("", 0, path, backlog=8)
+    try:
+        with socket.socket(socket.AF_UNIX) as client:
+            client.connect(str(path))
+        assert listener.get_inheritable()
+    finally:
+        listener.close()
+
+
+def test_supervisor_reports_ready_after_all_workers(configure, monkeypatch, tmp_path):
+    configure(server=config.Server(workers=2, bus=tmp_path / "bus"))
+    ready_file = tmp_path / "ready"
+    monkeypatch.setattr(upgrade, "ready_file", ready_file)
+    upgrade.supervise(tmp_path / "bus" / "upgrade", 2)
+    assert upgrade.notify("ready:1", attempts=20)
+    time.sleep(0.1)
+    assert not ready_file.exists()
+    assert upgrade.notify("ready:2", attempts=20)
+    for _ in range(50):
+        if ready_file.exists():
+            break
+        time.sleep(0.01)
+    assert ready_file.exists()
+    assert upgrade.ready_file is None
+
+
+def test_ready_ignores_removed_directory(configure, monkeypatch, tmp_path):
+    configure()
+    monkeypatch.setattr(upgrade, "ready_file", tmp_path / "gone" / "ready")
+    upgrade.ready()
+    assert upgrade.ready_file is None
@@ -0,0 +1,126 @@
+import asyncio
+import subprocess
+
+import pytest
+
+from server import upgrade, webhook
+from server.webhook import Rebuilder
+
+
+def git(repo, *args):
+    subprocess.run(
+        ["git", "-c", "user.name=test", "-c", "user.email=test@test", *args],
+        cwd=repo,
+        check=True,
+        capture_output=True,
+    )
+
+
+def commit(repo, files: dict[str, str]):
+    for name, content in files.items():
+        path = repo / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+    git(repo, "add", "-A")
+    git(repo, "commit", "-m", "update")
+
+
+@pytest.fixture
+def origin(tmp_path):
+    repo = tmp_path / "origin"
+    repo.mkdir()
+    git(repo, "init", "-b", "main")
+    commit(
+        repo,
+        {
+            "protected/index.html": "protected",
+            "public/index.html": "public",
+            "server/api.py": "api",
+            "pyproject.toml": "",
+            "poetry.lock": "",
+        },
+    )
+    return repo
+
+
+@pytest.fixture
+def builds(monkeypatch, tmp_path):
+    commands = []
+    upgrades = []
+    sh = webhook.sh
+
+    async def fake(command, cwd=None):
+        if not command.startswith("./dev.py"):
+            return await sh(command, cwd)
+        commands.append(command)
+        if "buildpyz" in command:
+            (cwd / "aidan.software.pyz").write_text("pyz")
+        return b""
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(webhook, "sh", fake)
+    monkeypatch.setattr(upgrade, "request", lambda: upgrades.append(1))
+    return commands, upgrades
+
+
+def test_rebuild_skips_unchanged_stages(tmp_path, origin, builds):
+    commands, upgrades = builds
+    build = tmp_path / "build"
+    rebuilder = Rebuilder(build, build / "repo", str(origin), "main", True)
+    build.mkdir()
+
+    asyncio.run(rebuilder.build())
+    assert commands == ["./dev.py buildstatic", "./dev.py buildpyz --no-static"]
+    assert (tmp_path / "aidan.software.pyz").exists()
+    status = rebuilder.load()["build"]
+    assert status["state"] == "built"
+    assert {"clone", "fetch", "frontend", "pyz"} <= status["stages"].keys()
+    assert len(upgrades) == 1
+
+    asyncio.run(rebuilder.build())
+    assert rebuilder.load()["build"]["state"] == "unchanged"
+    assert len(commands) == 2
+    assert len(upgrades) == 1
+
+    commit(origin, {"server/api.py": "changed"})
+    asyncio.run(rebuilder.build())
+    assert commands[2:] == ["./dev.py buildpyz --no-static"]
+    assert len(upgrades) == 2
+
+
+def test_rebuild_failure_is_reported(tmp_path, builds):
+    build = tmp_path / "build"
+    rebuilder = Rebuilder(
+        build, build / "repo", str(tmp_path / "missing"), "main", True
+    )
+    build.mkdir()
+    asyncio.run(rebuilder.build())
+    status = rebuilder.load()["build"]
+    assert status["state"] == "failed"
+    assert "git clone" in status["error"]
+    assert builds[1] == []
+
+
+def test_rebuild_requests_coalesce(tmp_path, monkeypatch):
+    started = []
+
+    async def run():
+        release = asyncio.Event()
+
+        async def build():
+            started.append(1)
+            await release.wait()
+
+        rebuilder = Rebuilder(tmp_path, tmp_path, "", "main", False)
+        monkeypatch.setattr(rebuilder, "build", build)
+        rebuilder.request()
+        await asyncio.sleep(0.1)
+        rebuilder.request()
+        rebuilder.request()
+        assert len(started) == 1
+        release.set()
+        await rebuilder.task
+        return rebuilder
+
+    assert not asyncio.run(run()).queued
+    assert len(started) == 2
@@ -0,0 +1,206 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+from pydantic import ValidationError
+
+from server import config, livecontrol, wsmanager
+from server.wsmanager import WSManager
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent: list[str] = []
+        self.closed: int | None = None
+        self.unblocked = asyncio.Event()
+        self.unblocked.set()
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        await self.unblocked.wait()
+        self.sent.append(text)
+
+    async def close(self, code: int = 1000):
+        self.closed = code
+
+
+def eventually(predicate, timeout: float = 0.25) -> bool:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.001)
+    return True
+
+
+async def connect(manager: WSManager, websocket: FakeWebSocket) -> str:
+    uid = await manager.connect(websocket)
+    await asyncio.sleep(0)
+    return uid
+
+
+def test_broadcast_reaches_every_connection(configure):
+    configure()
+
+    async def run():
+        manager = WSManager()
+        sockets = [FakeWebSocket() for _ in range(3)]
+        uids = [await connect(manager, ws) for ws in sockets]
+        manager.update("hello")
+        manager.activate(uids[:1])
+        await asyncio.sleep(0)
+        return manager, sockets, uids
+
+    manager, sockets, uids = asyncio.run(run())
+    assert sockets[0].sent == ["CONNECT", "UPDATE hello", "ACTIVATE"]
+    assert sockets[1].sent == sockets[2].sent == ["CONNECT", "UPDATE hello"]
+    assert manager.state[uids[0]] == (True, "hello")
+    assert manager.state[uids[1]] == (False, "hello")
+
+
+def test_unknown_uid_is_rejected_before_sending(configure):
+    configure()
+
+    async def run():
+        manager = WSManager()
+        websocket = FakeWebSocket()
+        uid = await connect(manager, websocket)
+        with pytest.raises(HTTPException):
+            manager.activate([uid, "missing"])
+        await asyncio.sleep(0)
+        return websocket
+
+    assert asyncio.run(run()).sent == ["CONNECT"]
+
+
+@pytest.mark.parametrize(
+    "payload, targets",
+    [
+        ({"uid": "a.1"}, ["a.1"]),
+        ({"uid": "a.1", "uids": ["b.1"]}, ["a.1", "b.1"]),
+        ({"uids": ["b.1"]}, ["b.1"]),
+        ({"all": True}, None),
+        ({}, ValidationError),
+        ({"uids": []}, ValidationError),
+        ({"uid": "a.1", "all": True}, ValidationError),
+    ],
+)
+def test_broadcast_must_be_explicit(payload, targets):
+    payload = {"command": "ACTIVATE", **payload}
+    if targets is ValidationError:
+        with pytest.raises(ValidationError):
+            livecontrol.Command(**payload)
+    else:
+        assert livecontrol.Command(**payload).targets() == targets
+
+
+@pytest.mark.parametrize(
+    "policy, expected",
+    [
+        ("drop", ["UPDATE 0", "UPDATE 1", "UPDATE 2"]),
+        ("coalesce", ["UPDATE 0", "UPDATE 4", "DEACTIVATE"]),
+    ],
+)
+def test_slow_consumer_policy(configure, policy, expected):
+    configure(livecontrol=config.LiveControl(queue_size=2, slow_consumer=policy))
+
+    async def run():
+        manager = WSManager()
+        slow = FakeWebSocket()
+        await manager.connect(slow)
+        slow.unblocked.clear()
+        await asyncio.sleep(0)
+        manager.update("0")
+        await asyncio.sleep(0)
+        for n in range(1, 5):
+            manager.update(str(n))
+        slow.unblocked.set()
+        await asyncio.sleep(0.01)
+        return slow
+
+    slow = asyncio.run(run())
+    assert slow.sent == ["CONNECT", *expected]
+
+
+def test_slow_consumer_disconnect(configure):
+    configure(livecontrol=config.LiveControl(queue_size=1, slow_consumer="disconnect"))
+
+    async def run():
+        manager = WSManager()
+        websocket = FakeWebSocket()
+        await manager.connect(websocket)
+        websocket.unblocked.clear()
+        manager.update("a")
+        await asyncio.sleep(0)
+        manager.update("b")
+        manager.update("c")
+        await asyncio.sleep(0)
+        return manager, websocket
+
+    manager, websocket = asyncio.run(run())
+    assert websocket.closed == 1008
+    assert manager.connections == {}
+
+
+def test_background_close_is_tracked_and_logged(configure, caplog):
+    configure(livecontrol=config.LiveControl(queue_size=1, slow_consumer="disconnect"))
+
+    class BrokenWebSocket(FakeWebSocket):
+        async def close(self, code: int = 1000):
+            raise ValueError("boom")
+
+    async def run():
+        manager = WSManager()
+        websocket = BrokenWebSocket()
+        await manager.connect(websocket)
+        websocket.unblocked.clear()
+        manager.update("a")
+        await asyncio.sleep(0)
+        manager.update("b")
+        manager.update("c")
+        assert len(wsmanager.closing) == 1
+        await manager.stop()
+
+    asyncio.run(run())
+    assert wsmanager.closing == set()
+    assert "Closing websocket failed" in caplog.text
+
+
+def test_heartbeat_pings_and_reaps_silent_clients(configure):
+    configure()
+
+    async def run():
+        manager = WSManager()
+        alive, silent = FakeWebSocket(), FakeWebSocket()
+        alive_uid = await connect(manager, alive)
+        await connect(manager, silent)
+        manager.start(interval=0.02, timeout=0.01)
+        for _ in range(4):
+            await asyncio.sleep(0.02)
+            manager.seen(alive_uid)
+        await manager.stop()
+        return manager, alive, silent
+
+    manager, alive, silent = asyncio.run(run())
+    assert silent.closed == 1001
+    assert "PING" in silent.sent
+    assert alive.sent.count("PING") >= 2
+    assert manager.connections == {}
+
+
+def test_live_route_receives_without_polling(configure):
+    configure()
+    app = FastAPI()
+    app.include_router(livecontrol.api)
+    with TestClient(app) as client:
+        with client.websocket_connect("/api/live") as websocket:
+            assert websocket.receive_text() == "CONNECT"
+            (uid,) = livecontrol.manager.connections
+            seen = livecontrol.manager.connections[uid].seen
+            websocket.send_text("PONG")
+            assert eventually(lambda: livecontrol.manager.connections[uid].seen > seen)
+        assert eventually(lambda: not livecontrol.manager.connections)